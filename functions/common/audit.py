@@ -0,0 +1,216 @@
+import gzip
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import simplejson  # handles decimal.Decimal
+
+logger = logging.getLogger(__name__)
+
+
+class AuditModes:
+    OBJECT_PER_TRANSMISSION = 'object_per_transmission'
+    UPDATE_ARCHIVE = 'update_archive'
+
+
+class AuditDurabilityPolicies:
+    BLOCK = 'block'  # wait for room in the queue
+    BEST_EFFORT = 'best_effort'  # wait for room in the queue for a limited time, then drop the write
+    DROP = 'drop'  # drop the write right away if the queue is full
+
+
+AUDIT_MODE = os.environ['AUDIT_MODE']
+AUDIT_DURABILITY_POLICY = os.environ['AUDIT_DURABILITY_POLICY']
+AUDIT_QUEUE_SIZE = int(os.environ['AUDIT_QUEUE_SIZE'])
+AUDIT_WORKERS = int(os.environ['AUDIT_WORKERS'])
+
+AUDIT_BEST_EFFORT_TIMEOUT_SEC = 1
+AUDIT_DRAIN_TIMEOUT_SEC = 30
+
+
+class AuditArchive:
+    """
+    Audit records of one update packed into one S3 object as JSON lines. Every line is compressed as a separate gzip
+    member (a concatenation of gzip members is a valid gzip file), hence a single record can be fetched with a ranged
+    GET without downloading the whole archive.
+    """
+
+    def __init__(self, s3_key):
+        self.s3_key = s3_key
+
+        self._members = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._members)
+
+    def append(self, obj_dict):
+        """Returns the line number of the record and its byte range within the archive ("<first>-<last>")."""
+        member = gzip.compress(simplejson.dumps(obj_dict).encode('utf8') + b'\n')
+
+        with self._lock:
+            line = len(self._members)
+            offset = self._size
+            self._members.append(member)
+            self._size += len(member)
+
+        return line, f"{offset}-{offset + len(member) - 1}"
+
+    def flush(self, s3_bucket):
+        with self._lock:
+            if not self._members:
+                return None
+            body = b''.join(self._members)
+
+        response = s3_bucket.put_object(
+            Key=self.s3_key,
+            Body=body,
+            ContentType='application/x-ndjson',
+        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                'S3 PUT_OBJECT ( BUCKET: %s | KEY: %s ): %s audit records', s3_bucket.name, self.s3_key, len(self)
+            )
+        return response
+
+
+class AuditSink:
+    """
+    Runs audit writes (S3 I/O) on a bounded background executor so they stay out of the latency path. The sink needs
+    to be drained before a lambda handler returns - background threads of a frozen lambda container don't run.
+    """
+
+    def __init__(
+            self,
+            max_workers=AUDIT_WORKERS,
+            max_queue_size=AUDIT_QUEUE_SIZE,
+            durability_policy=AUDIT_DURABILITY_POLICY,
+    ):
+        self.max_queue_size = max_queue_size
+        self.durability_policy = durability_policy
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='audit')
+        self._slots = threading.BoundedSemaphore(max_queue_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+        self._dropped_num = 0
+        self._failed_num = 0
+        self._max_flush_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, func, *args, **kwargs):
+        if self.durability_policy == AuditDurabilityPolicies.BLOCK:
+            acquired = self._slots.acquire()
+        elif self.durability_policy == AuditDurabilityPolicies.BEST_EFFORT:
+            acquired = self._slots.acquire(timeout=AUDIT_BEST_EFFORT_TIMEOUT_SEC)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+
+        if not acquired:
+            with self._lock:
+                self._dropped_num += 1
+            logger.warning('AUDIT SINK: queue is full (%s), audit write dropped: %s', self.max_queue_size, func)
+            return None
+
+        future = self._executor.submit(self._write, time.monotonic(), func, args, kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _write(self, submitted_at, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._failed_num += 1
+            logger.exception('AUDIT SINK: audit write failed')
+        finally:
+            self._slots.release()
+            flush_latency = time.monotonic() - submitted_at
+            with self._lock:
+                self._max_flush_latency = max(self._max_flush_latency, flush_latency)
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def drain(self, timeout=AUDIT_DRAIN_TIMEOUT_SEC):
+        """
+        Waits for the writes submitted so far and returns (as well as logs) the stats of the sink since the previous
+        drain.
+        """
+        started_at = time.monotonic()
+        with self._lock:
+            pending = list(self._pending)
+        not_done = wait(pending, timeout=timeout).not_done if pending else ()
+
+        with self._lock:
+            stats = {
+                'drained_num': len(pending) - len(not_done),
+                'not_drained_num': len(not_done),
+                'dropped_num': self._dropped_num,
+                'failed_num': self._failed_num,
+                'queue_depth': len(self._pending),
+                'max_flush_latency_ms': int(self._max_flush_latency * 1000),
+                'drain_ms': int((time.monotonic() - started_at) * 1000),
+            }
+            self._dropped_num = 0
+            self._failed_num = 0
+            self._max_flush_latency = 0.0
+
+        if not_done or stats['dropped_num'] or stats['failed_num']:
+            logger.warning('AUDIT SINK STATS: %s', stats)
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info('AUDIT SINK STATS: %s', stats)
+        return stats
+
+
+audit_sink = AuditSink()
+
+
+def read_audit_record(s3_bucket, key, line=None, byte_range=None):
+    """
+    Resolves one audit record. Records of archives are fetched with a ranged GET when byte_range is known (otherwise
+    the archive is streamed only up to the requested line), legacy records are standalone S3 objects.
+    """
+    if byte_range is not None:
+        response = s3_bucket.Object(key).get(Range=f"bytes={byte_range}")
+        return simplejson.loads(gzip.decompress(response['Body'].read()).decode('utf8'))
+
+    response = s3_bucket.Object(key).get()
+    if line is None:
+        return simplejson.loads(response['Body'].read().decode('utf8'))
+
+    for current_line, line_bytes in enumerate(_iter_gzip_lines(response['Body'])):
+        if current_line == int(line):
+            return simplejson.loads(line_bytes.decode('utf8'))
+    return None
+
+
+def _iter_gzip_lines(stream, chunk_size=64 * 1024):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)  # gzip header
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        while chunk:
+            pending += decompressor.decompress(chunk)
+            chunk = decompressor.unused_data
+            if decompressor.eof:
+                # next gzip member
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+        *lines, pending = pending.split(b'\n')
+        yield from lines
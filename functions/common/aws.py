@@ -0,0 +1,53 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+REGION = os.environ['REGION']
+
+# broadcast workers, audit writers and background tasks may all talk to AWS at the same time
+AWS_MAX_POOL_CONNECTIONS = \
+    int(os.environ['BROADCAST_MAX_WORKERS']) + int(os.environ['AUDIT_WORKERS']) + 4
+AWS_MAX_ATTEMPTS = int(os.environ['AWS_MAX_ATTEMPTS'])
+
+_session = None
+# the session itself is not thread-safe either: clients and resources are created from it one at a time
+_session_lock = threading.RLock()
+
+
+def _create_config():
+    config_kwargs = {
+        'region_name': REGION,
+        'max_pool_connections': AWS_MAX_POOL_CONNECTIONS,
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html#adaptive-retry-mode
+        'retries': {'mode': 'adaptive', 'max_attempts': AWS_MAX_ATTEMPTS},
+    }
+    if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+        # not supported by older botocore versions (the one bundled with lambda runtime may be one of them)
+        config_kwargs['tcp_keepalive'] = True
+    return Config(**config_kwargs)
+
+
+def get_session():
+    """
+    One boto3 session shared by all the clients and resources of the process (rather than the default session,
+    which is global state that any library may touch). Use create_client() and create_resource() to create clients
+    and resources from it.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = boto3.session.Session(region_name=REGION)
+    return _session
+
+
+def create_client(service_name):
+    with _session_lock:
+        return get_session().client(service_name, config=_create_config())
+
+
+def create_resource(service_name):
+    with _session_lock:
+        return get_session().resource(service_name, config=_create_config())
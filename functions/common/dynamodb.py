@@ -1,23 +1,38 @@
 import logging
 import os
+import random
+import time
+from distutils.util import strtobool
 
-import boto3
+from boto3.dynamodb.types import TypeSerializer
 
-logger = logging.getLogger(__name__)
+from functions.common.aws import create_resource, create_client
+from functions.common.utils import SwiperError, LazyObject
 
-REGION = os.environ['REGION']
+logger = logging.getLogger(__name__)
 
 SWIPER_CHAT_DATA_DDB_TABLE_NAME = os.environ['SWIPER_CHAT_DATA_DDB_TABLE_NAME']
 MESSAGE_TRANSMISSION_DDB_TABLE_NAME = os.environ['MESSAGE_TRANSMISSION_DDB_TABLE_NAME']
 TOPIC_DDB_TABLE_NAME = os.environ['TOPIC_DDB_TABLE_NAME']
 ALLOGROOMING_DDB_TABLE_NAME = os.environ['ALLOGROOMING_DDB_TABLE_NAME']
+EDIT_VERSION_DDB_TABLE_NAME = os.environ['EDIT_VERSION_DDB_TABLE_NAME']
+
+# batch writes go through the low-level client with attribute values serialized upfront (no per-call resource model
+# transformations)
+DDB_LOW_LEVEL_BATCH_WRITES = bool(strtobool(os.environ['DDB_LOW_LEVEL_BATCH_WRITES']))
+
+# constructed on first use (not during cold start)
+dynamodb = LazyObject(lambda: create_resource('dynamodb'))
+dynamodb_client = LazyObject(lambda: create_client('dynamodb'))
 
-dynamodb = boto3.resource('dynamodb', region_name=REGION)
+swiper_chat_data_table = LazyObject(lambda: dynamodb.Table(SWIPER_CHAT_DATA_DDB_TABLE_NAME))
+msg_transmission_table = LazyObject(lambda: dynamodb.Table(MESSAGE_TRANSMISSION_DDB_TABLE_NAME))
+topic_table = LazyObject(lambda: dynamodb.Table(TOPIC_DDB_TABLE_NAME))
+allogrooming_table = LazyObject(lambda: dynamodb.Table(ALLOGROOMING_DDB_TABLE_NAME))
+edit_version_table = LazyObject(lambda: dynamodb.Table(EDIT_VERSION_DDB_TABLE_NAME))
 
-swiper_chat_data_table = dynamodb.Table(SWIPER_CHAT_DATA_DDB_TABLE_NAME)
-msg_transmission_table = dynamodb.Table(MESSAGE_TRANSMISSION_DDB_TABLE_NAME)
-topic_table = dynamodb.Table(TOPIC_DDB_TABLE_NAME)
-allogrooming_table = dynamodb.Table(ALLOGROOMING_DDB_TABLE_NAME)
+BATCH_WRITE_MAX_ITEMS = 25  # DynamoDB limit
+BATCH_WRITE_MAX_ATTEMPTS = 8
 
 
 class DdbFields:
@@ -28,13 +43,16 @@ class DdbFields:
 
     CHAT = 'chat'
     IS_SWIPER_AUTHORIZED = 'is_swiper_authorized'
+    ACTIVE_SWIPER_BOT_ID = 'active_swiper_bot_id'  # present only when swiper is authorized (sparse index)
     SWIPER_USERNAME = 'swiper_username'
     USERNAME = 'username'
     BASE_NAME = 'base_name'
+    VERSION = 'version'  # optimistic locking (incremented by every write of the item)
 
     TOPIC_ID = 'topic_id'
     ALLOGROOMING_ID = 'allogrooming_id'
     ORIGINAL_MSG_TRANS_ID = 'original_msg_trans_id'
+    LEGACY_ID = 'legacy_id'
 
     SENDER_MSG_ID = 'sender_msg_id'
     SENDER_CHAT_ID = 'sender_chat_id'
@@ -44,7 +62,99 @@ class DdbFields:
     RECEIVER_CHAT_ID = 'receiver_chat_id'
     RECEIVER_BOT_ID = 'receiver_bot_id'
 
+    # composite keys (exact match GSI lookups instead of post-read filtering)
+    SENDER_MSG_KEY = 'sender_msg_key'  # "<sender_bot_id>#<sender_chat_id>#<sender_msg_id>"
+
     RED_HEART = 'red_heart'
 
+    EDIT_VERSION = 'edit_version'
+    EDIT_CLAIMED_AT_MS = 'edit_claimed_at_ms'
+    EXPIRES_AT = 'expires_at'  # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/TTL.html
+
     SENDER_UPDATE_S3_KEY = 'sender_update_s3_key'
     RECEIVER_MSG_S3_KEY = 'receiver_msg_s3_key'
+    RECEIVER_MSG_S3_LINE = 'receiver_msg_s3_line'  # when RECEIVER_MSG_S3_KEY points to an audit archive
+    RECEIVER_MSG_S3_BYTE_RANGE = 'receiver_msg_s3_byte_range'  # when RECEIVER_MSG_S3_KEY points to an audit archive
+
+
+def compose_ddb_key(*parts):
+    """
+    Builds a string key out of several ids (for ex. "<bot_id>#<chat_id>#<msg_id>").
+    """
+    return '#'.join(str(part) for part in parts)
+
+
+def compose_projection(*fields):
+    """
+    Builds ProjectionExpression (along with placeholders for attribute names, some of them may be reserved words) that
+    makes a read return only the given attributes.
+    """
+    placeholders = {f"#p{i}": field for i, field in enumerate(fields)}
+    return {
+        'ProjectionExpression': ', '.join(placeholders),
+        'ExpressionAttributeNames': placeholders,
+    }
+
+
+def query_items(table, **query_kwargs):
+    """
+    Lazily yields items of all the pages of a query (follows LastEvaluatedKey), a page is requested only when the
+    items of the previous one are consumed.
+    """
+    while True:
+        query_result = table.query(**query_kwargs)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                'DDB QUERY ( TABLE: %s | INDEX: %s ): %s items (scanned: %s)',
+                table.name,
+                query_kwargs.get('IndexName'),
+                query_result['Count'],
+                query_result['ScannedCount'],
+            )
+
+        yield from query_result['Items']
+
+        last_evaluated_key = query_result.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+_type_serializer = TypeSerializer()
+
+
+def serialize_item(item):
+    return {field: _type_serializer.serialize(value) for field, value in item.items()}
+
+
+def batch_put_items(table, items):
+    if DDB_LOW_LEVEL_BATCH_WRITES:
+        batch_write_item = dynamodb_client.batch_write_item
+        items = [serialize_item(item) for item in items]
+    else:
+        batch_write_item = dynamodb.batch_write_item
+
+    for i in range(0, len(items), BATCH_WRITE_MAX_ITEMS):
+        _batch_write(
+            batch_write_item,
+            table.name,
+            [{'PutRequest': {'Item': item}} for item in items[i:i + BATCH_WRITE_MAX_ITEMS]],
+        )
+
+
+def _batch_write(batch_write_item, table_name, write_requests):
+    request_items = {table_name: write_requests}
+    attempt = 0
+    while True:
+        response = batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems')
+        if not request_items:
+            return
+
+        attempt += 1
+        if attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+            raise SwiperError(f"DDB BATCH_WRITE_ITEM: items left unprocessed after {attempt} attempts")
+
+        # https://docs.aws.amazon.com/general/latest/gr/api-retries.html (exponential backoff with full jitter)
+        logger.info('DDB BATCH_WRITE_ITEM: retrying unprocessed items (attempt %s)', attempt)
+        time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 2.0)))
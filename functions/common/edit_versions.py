@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from functions.common.dynamodb import edit_version_table, DdbFields
+from functions.common.utils import timestamp_now_ms
+
+logger = logging.getLogger(__name__)
+
+EDIT_DEBOUNCE_SEC = float(os.environ['EDIT_DEBOUNCE_SEC'])
+EDIT_VERSION_CHECK_INTERVAL_SEC = 1
+EDIT_VERSION_TTL_SEC = 24 * 60 * 60  # edit versions matter only while edits are being propagated
+
+
+def claim_edit_version(sender_msg_key, edit_version):
+    """
+    Records edit_version as the newest version of the message unless a newer one is recorded already (in which case
+    the edit should be dropped). Returns a tuple (claimed, previous_claimed_at_ms) - the latter is None if no version
+    of the message was claimed before.
+    """
+    edit_version = int(edit_version)
+    try:
+        response = edit_version_table.update_item(
+            Key={
+                DdbFields.SENDER_MSG_KEY: sender_msg_key,
+            },
+            UpdateExpression=(
+                f"SET {DdbFields.EDIT_VERSION} = :edit_version, {DdbFields.EDIT_CLAIMED_AT_MS} = :claimed_at_ms, "
+                f"{DdbFields.EXPIRES_AT} = :expires_at"
+            ),
+            ConditionExpression=(
+                f"attribute_not_exists({DdbFields.EDIT_VERSION}) OR {DdbFields.EDIT_VERSION} < :edit_version"
+            ),
+            ExpressionAttributeValues={
+                ':edit_version': edit_version,
+                ':claimed_at_ms': timestamp_now_ms(),
+                ':expires_at': int(time.time()) + EDIT_VERSION_TTL_SEC,
+            },
+            ReturnValues='UPDATED_OLD',
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info('EDIT VERSION %s OF %s IS STALE ALREADY', edit_version, sender_msg_key)
+        return False, None
+
+    previous_claimed_at_ms = response.get('Attributes', {}).get(DdbFields.EDIT_CLAIMED_AT_MS)
+    return True, None if previous_claimed_at_ms is None else int(previous_claimed_at_ms)
+
+
+def read_edit_version(sender_msg_key):
+    response = edit_version_table.get_item(
+        Key={
+            DdbFields.SENDER_MSG_KEY: sender_msg_key,
+        },
+        ProjectionExpression=DdbFields.EDIT_VERSION,
+        ConsistentRead=True,
+    )
+    item = response.get('Item')
+    if not item:
+        return None
+    return int(item[DdbFields.EDIT_VERSION])
+
+
+class EditVersionWatcher:
+    """
+    Tells whether a newer version of the message was recorded since edit_version was claimed (hence the propagation of
+    edit_version can be aborted). DDB is consulted at most once in EDIT_VERSION_CHECK_INTERVAL_SEC.
+    """
+
+    def __init__(self, sender_msg_key, edit_version):
+        self.sender_msg_key = sender_msg_key
+        self.edit_version = int(edit_version)
+
+        self._stale = False
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()  # the watcher is consulted by several broadcast workers
+
+        self._previous_claimed_at_ms = None
+
+    def claim(self):
+        """See claim_edit_version(). Returns False if the edit should be dropped."""
+        claimed, self._previous_claimed_at_ms = claim_edit_version(self.sender_msg_key, self.edit_version)
+        return claimed
+
+    def is_stale(self):
+        with self._lock:
+            return self._is_stale()
+
+    def _is_stale(self):
+        if self._stale:
+            return True
+
+        now = time.monotonic()
+        if now - self._checked_at >= EDIT_VERSION_CHECK_INTERVAL_SEC:
+            self._checked_at = now
+            newest_edit_version = read_edit_version(self.sender_msg_key)
+            self._stale = newest_edit_version is not None and newest_edit_version > self.edit_version
+            if self._stale:
+                logger.info('EDIT VERSION %s OF %s WAS SUPERSEDED', self.edit_version, self.sender_msg_key)
+
+        return self._stale
+
+    def is_in_burst(self):
+        """True if the previous version of the message was claimed less than EDIT_DEBOUNCE_SEC ago."""
+        if self._previous_claimed_at_ms is None:
+            return False
+        return timestamp_now_ms() - self._previous_claimed_at_ms < EDIT_DEBOUNCE_SEC * 1000
+
+    def debounce(self):
+        """
+        Waits for more edits to come (only if this edit is a part of a burst of edits - a lone edit is propagated right
+        away) and returns True if this version is still the newest one.
+        """
+        if not self.is_in_burst():
+            return True
+
+        time.sleep(EDIT_DEBOUNCE_SEC)
+        with self._lock:
+            self._checked_at = float('-inf')  # force the check
+            return not self._is_stale()
@@ -2,16 +2,18 @@ import logging
 import os
 from pprint import pformat
 
-import boto3
 import simplejson  # handles decimal.Decimal
 
+from functions.common.aws import create_resource
+from functions.common.utils import LazyObject
+
 logger = logging.getLogger(__name__)
 
-REGION = os.environ['REGION']
 MAIN_S3_BUCKET_NAME = os.environ['MAIN_S3_BUCKET_NAME']
 
-s3 = boto3.resource('s3', region_name=REGION)
-main_bucket = s3.Bucket(name=MAIN_S3_BUCKET_NAME)
+# constructed on first use (not during cold start)
+s3 = LazyObject(lambda: create_resource('s3'))
+main_bucket = LazyObject(lambda: s3.Bucket(name=MAIN_S3_BUCKET_NAME))
 
 
 def put_s3_object(s3_bucket, key, obj_dict):
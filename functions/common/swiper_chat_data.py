@@ -1,61 +1,236 @@
+import copy
 import logging
 import os
+from decimal import Decimal
 from distutils.util import strtobool
 from pprint import pformat
 
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 
-from functions.common.dynamodb import swiper_chat_data_table, DdbFields
+from functions.common.b64_json_utils import b64_decode_json
+from functions.common.cache import TtlLruCache
+from functions.common.dynamodb import swiper_chat_data_table, DdbFields, query_items, compose_projection
+from functions.common.utils import SwiperError
 
 logger = logging.getLogger(__name__)
 
 AUTHORIZE_STRANGERS_BY_DEFAULT = bool(strtobool(os.environ['AUTHORIZE_STRANGERS_BY_DEFAULT']))
+ACTIVE_SWIPERS_CACHE_TTL_SEC = float(os.environ['ACTIVE_SWIPERS_CACHE_TTL_SEC'])
+SWIPERS_CACHE_TTL_SEC = float(os.environ['SWIPERS_CACHE_TTL_SEC'])  # 0 disables the cache
+SWIPERS_CACHE_MAX_SIZE = int(os.environ['SWIPERS_CACHE_MAX_SIZE'])
 
+# stored as native DDB maps (rows written before that have them as base64-encoded JSON strings)
+MAP_FIELDS = (DdbFields.CHAT, DdbFields.SWIPER_USERNAME)
+
+# bot id -> frozenset of chat ids of authorized swipers
+_active_swiper_chat_ids_cache = TtlLruCache(ttl_sec=ACTIVE_SWIPERS_CACHE_TTL_SEC, max_size=16)
+# (bot id, chat id) -> decoded swiper chat data; a stale record can't overwrite newer data (writes are conditioned on
+# the version of the record), it is only the reads that may lag behind for up to SWIPERS_CACHE_TTL_SEC
+_swiper_chat_data_cache = TtlLruCache(ttl_sec=SWIPERS_CACHE_TTL_SEC, max_size=SWIPERS_CACHE_MAX_SIZE)
+
+
+def read_swiper_chat_data(chat_id, bot_id, consistent_read=False):
+    """
+    Consistent reads bypass the cache of swiper records (the cache is refreshed by them though).
+    """
+    key = _compose_swiper_chat_data_key(chat_id=chat_id, bot_id=bot_id)
+    if not consistent_read:
+        cached_item = get_cached_swiper_chat_data(key)
+        if cached_item is not None:
+            return cached_item
 
-def read_swiper_chat_data(chat_id, bot_id):
-    empty_item = {
-        DdbFields.CHAT_ID: int(chat_id),
-        DdbFields.BOT_ID: int(bot_id),
-    }
     if logger.isEnabledFor(logging.INFO):
-        logger.info('SWIPER CHAT DATA - GET_ITEM (DDB) KEY:\n%s', pformat(empty_item))
-    response = swiper_chat_data_table.get_item(Key=empty_item)
+        logger.info('SWIPER CHAT DATA - GET_ITEM (DDB) KEY:\n%s', pformat(key))
+    response = swiper_chat_data_table.get_item(Key=key, ConsistentRead=consistent_read)
     if logger.isEnabledFor(logging.INFO):
         logger.info('SWIPER CHAT DATA - GET_ITEM (DDB):\n%s', pformat(response))
 
     item = response.get('Item')
-    if not item:
+    if item:
+        item = decode_swiper_chat_data(item)
+    else:
         # does not exist yet
-        empty_item[DdbFields.IS_SWIPER_AUTHORIZED] = AUTHORIZE_STRANGERS_BY_DEFAULT
-        return empty_item
+        item = _compose_empty_swiper_chat_data(key)
+
+    cache_swiper_chat_data(item)
+    return item
+
+
+def get_cached_swiper_chat_data(key):
+    cached_item = _swiper_chat_data_cache.get((key[DdbFields.BOT_ID], key[DdbFields.CHAT_ID]))
+    if cached_item is None:
+        return None
+    # every Swiper gets its own copy to modify
+    return copy.deepcopy(cached_item)
+
 
+def cache_swiper_chat_data(swiper_chat_data):
+    """
+    Write-through: to be called with the complete record after it was read or written.
+    """
+    _swiper_chat_data_cache.put(
+        (int(swiper_chat_data[DdbFields.BOT_ID]), int(swiper_chat_data[DdbFields.CHAT_ID])),
+        copy.deepcopy(swiper_chat_data),
+    )
+
+
+def decode_swiper_chat_data(item):
+    """
+    Map fields are turned into plain python objects (legacy base64-encoded JSON is decoded transparently, DDB numbers
+    become ints/floats again). A legacy field that fails to decode is dropped (it is going to be written anew the same
+    way as if it never existed) instead of making the whole record unreadable.
+    """
+    for field in MAP_FIELDS:
+        if field not in item:
+            continue
+        value = item[field]
+        if not isinstance(value, str):
+            item[field] = _from_ddb_value(value)
+            continue
+
+        # legacy row
+        try:
+            item[field] = b64_decode_json(value)
+        except ValueError:
+            logger.exception('SWIPER CHAT DATA: FAILED TO DECODE LEGACY FIELD %s OF CHAT %s (DROPPED)',
+                             field, item.get(DdbFields.CHAT_ID))
+            del item[field]
     return item
 
 
-def write_swiper_chat_data(swiper_chat_data):
-    # https://stackoverflow.com/questions/43667229/difference-between-dynamodb-putitem-vs-updateitem
-    # TODO oleksandr: implement optimistic locking using conditional DDB writing (and exception if condition not met)
-    response = swiper_chat_data_table.put_item(Item=swiper_chat_data)
+def encode_swiper_chat_data_fields(fields):
+    return {
+        field: _to_ddb_value(value) if field in MAP_FIELDS else value
+        for field, value in fields.items()
+    }
+
+
+def _to_ddb_value(value):
+    # DDB doesn't accept floats (only Decimals)
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_ddb_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_ddb_value(v) for v in value]
+    return value
+
+
+def _from_ddb_value(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _from_ddb_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_ddb_value(v) for v in value]
+    return value
+
+
+def _compose_swiper_chat_data_key(chat_id, bot_id):
+    return {
+        DdbFields.CHAT_ID: int(chat_id),
+        DdbFields.BOT_ID: int(bot_id),
+    }
+
+
+def _compose_empty_swiper_chat_data(key):
+    return {
+        **key,
+        DdbFields.IS_SWIPER_AUTHORIZED: AUTHORIZE_STRANGERS_BY_DEFAULT,
+    }
+
+
+class SwiperChatDataConflict(SwiperError):
+    """
+    Swiper chat data was written by someone else since it was read.
+    """
+
+
+def update_swiper_chat_data(chat_id, bot_id, fields, expected_version):
+    """
+    Writes only the given fields of swiper chat data (UpdateItem) provided that the item is still of expected_version
+    (None stands for items that don't exist yet or were written before versioning was introduced). Raises
+    SwiperChatDataConflict otherwise. Returns the new version of the item.
+    """
+    key = _compose_swiper_chat_data_key(chat_id=chat_id, bot_id=bot_id)
+
+    names = {'#version': DdbFields.VERSION}
+    values = {':one': 1, ':zero': 0}
+    set_actions = ['#version = if_not_exists(#version, :zero) + :one']
+    remove_actions = []
+
+    for i, (field, value) in enumerate(encode_swiper_chat_data_fields(fields).items()):
+        names[f"#f{i}"] = field
+        values[f":f{i}"] = value
+        set_actions.append(f"#f{i} = :f{i}")
+
+    is_swiper_authorized = None
+    if DdbFields.IS_SWIPER_AUTHORIZED in fields:
+        # active_swiper_bot_id is present only when swiper is authorized (sparse index)
+        is_swiper_authorized = bool(fields[DdbFields.IS_SWIPER_AUTHORIZED])
+        names['#active_swiper_bot_id'] = DdbFields.ACTIVE_SWIPER_BOT_ID
+        if is_swiper_authorized:
+            values[':active_swiper_bot_id'] = key[DdbFields.BOT_ID]
+            set_actions.append('#active_swiper_bot_id = :active_swiper_bot_id')
+        else:
+            remove_actions.append('#active_swiper_bot_id')
+
+    update_expression = f"SET {', '.join(set_actions)}"
+    if remove_actions:
+        update_expression += f" REMOVE {', '.join(remove_actions)}"
+
+    if expected_version is None:
+        condition_expression = 'attribute_not_exists(#version)'
+    else:
+        condition_expression = '#version = :expected_version'
+        values[':expected_version'] = int(expected_version)
+
+    try:
+        response = swiper_chat_data_table.update_item(
+            Key=key,
+            UpdateExpression=update_expression,
+            ConditionExpression=condition_expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues='UPDATED_NEW',
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        _swiper_chat_data_cache.invalidate((key[DdbFields.BOT_ID], key[DdbFields.CHAT_ID]))
+        raise SwiperChatDataConflict(
+            f"swiper chat data of chat_id={chat_id} ; bot_id={bot_id} is not of version {expected_version} any more"
+        ) from e
+
     if logger.isEnabledFor(logging.INFO):
-        logger.info('SWIPER CHAT DATA - PUT_ITEM (DDB):\n%s', pformat(response))
+        logger.info('SWIPER CHAT DATA - UPDATE_ITEM (DDB) FIELDS: %s\n%s', list(fields), pformat(response))
 
-    return response
+    if is_swiper_authorized is not None:
+        cached_chat_ids = _active_swiper_chat_ids_cache.get(key[DdbFields.BOT_ID])
+        if cached_chat_ids is not None and (key[DdbFields.CHAT_ID] in cached_chat_ids) != is_swiper_authorized:
+            # authorization has changed
+            _active_swiper_chat_ids_cache.invalidate(key[DdbFields.BOT_ID])
+
+    return int(response['Attributes'][DdbFields.VERSION])
 
 
 def find_all_active_swiper_chat_ids(bot_id):
     bot_id = int(bot_id)
 
-    # TODo oleksandr: do we need to paginate over the results ?
-    scan_result = swiper_chat_data_table.scan(
-        # TODO oleksandr: do we need to create a correspondent global secondary index ?
-        FilterExpression=(
-                Attr(DdbFields.BOT_ID).eq(bot_id) &
-                Attr(DdbFields.IS_SWIPER_AUTHORIZED).eq(True)
-        ),
-        ProjectionExpression=DdbFields.CHAT_ID,
-    )
-    if logger.isEnabledFor(logging.INFO):
-        logger.info('FIND ACTIVE SWIPER CHAT IDS (DDB SCAN RESPONSE):\n%s', scan_result)
+    swiper_chat_ids = _active_swiper_chat_ids_cache.get(bot_id)
+    if swiper_chat_ids is None:
+        swiper_chat_ids = frozenset(_query_active_swiper_chat_ids(bot_id))
+        _active_swiper_chat_ids_cache.put(bot_id, swiper_chat_ids)
+
+    return set(swiper_chat_ids)
+
 
-    swiper_chat_ids = {item[DdbFields.CHAT_ID] for item in scan_result['Items']}
-    return swiper_chat_ids
+def _query_active_swiper_chat_ids(bot_id):
+    for item in query_items(
+            swiper_chat_data_table,
+            IndexName='byActiveSwiperBotId',
+            KeyConditionExpression=Key(DdbFields.ACTIVE_SWIPER_BOT_ID).eq(bot_id),
+            **compose_projection(DdbFields.CHAT_ID),
+    ):
+        yield int(item[DdbFields.CHAT_ID])
@@ -1,11 +1,18 @@
+import asyncio
+import contextvars
+import itertools
 import logging
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from pprint import pformat
 
 logger = logging.getLogger(__name__)
 
+_background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='background')
+
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -34,6 +41,16 @@ def split_text(text, limit):
         yield text[i:i + limit]
 
 
+def peek_items(iterable, num):
+    """
+    Reads the first `num` items of a (lazy) iterable. Returns a list of those items and an iterator over all the items
+    (including the peeked ones).
+    """
+    iterator = iter(iterable)
+    head = list(itertools.islice(iterator, num))
+    return head, itertools.chain(head, iterator)
+
+
 def send_partitioned_text(chat, text, limit=4000):
     for text_part in split_text(text, limit):
         chat.send_message(text_part)
@@ -77,5 +94,52 @@ def fail_safely(static_response=None):
     return decorator
 
 
+def submit_in_context(executor, func, *args, **kwargs):
+    """
+    executor.submit() that runs func in a copy of the caller's context (context variables, such as the update being
+    processed, are not inherited by pool threads otherwise).
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+async def offload(executor, func, *args, **kwargs):
+    """
+    Awaitable counterpart of submit_in_context(): runs blocking func (Bot API calls, boto3 etc.) in a thread of
+    executor without blocking the event loop.
+    """
+    return await asyncio.wrap_future(submit_in_context(executor, func, *args, **kwargs))
+
+
+def start_in_background(func, *args, **kwargs):
+    """
+    Runs func in a background thread so that it overlaps with whatever the caller does next. Returns a future (which
+    should be waited for before the lambda handler returns); exceptions are logged rather than raised.
+    """
+    return submit_in_context(_background_executor, fail_safely()(func), *args, **kwargs)
+
+
+class LazyObject:
+    """
+    Proxy that creates the underlying object with `factory()` on first attribute access (for ex., AWS resources are
+    not constructed during a lambda cold start unless the update needs them).
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def get_obj(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name):
+        # called only for attributes that are not found in the proxy itself
+        return getattr(self.get_obj(), name)
+
+
 class SwiperError(Exception):
     ...
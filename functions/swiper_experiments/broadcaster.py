@@ -0,0 +1,294 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import RetryAfter
+
+from functions.common import logging  # force log config of functions/common/__init__.py
+from functions.common.utils import SwiperError, submit_in_context, offload
+from functions.swiper_experiments.constants import BROADCAST_MAX_WORKERS, TELEGRAM_GLOBAL_MSGS_PER_SEC, \
+    TELEGRAM_CHAT_MSGS_PER_SEC, ASYNC_BROADCAST_MAX_TASKS
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_CHATS = 10000
+MAX_RETRY_AFTER_ATTEMPTS = 3
+RECEIVERS_READER_WORKERS = 4  # async mode: lazy receivers of concurrent broadcasts are read in parallel
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second are added to the bucket, at most `capacity` tokens can be
+    accumulated. Tokens are reserved in advance (the bucket can go into debt), so waiting threads are served in order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(self.rate, 1.0))
+
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def reserve(self):
+        """Takes one token and returns the number of seconds to wait before it can actually be used."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Makes sure no tokens are handed out for the next `seconds` (for ex., when Telegram asks to retry later)."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class TelegramRateLimiter:
+    """
+    https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+    """
+
+    def __init__(
+            self,
+            global_msgs_per_sec=TELEGRAM_GLOBAL_MSGS_PER_SEC,
+            chat_msgs_per_sec=TELEGRAM_CHAT_MSGS_PER_SEC,
+            max_tracked_chats=MAX_TRACKED_CHATS,
+    ):
+        self.global_bucket = TokenBucket(global_msgs_per_sec)
+        self.chat_msgs_per_sec = chat_msgs_per_sec
+        self.max_tracked_chats = max_tracked_chats
+
+        self._chat_buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_chat_bucket(self, chat_id):
+        chat_id_str = str(chat_id)  # let's be sure that chat id is always of the same type when used as a dict key
+
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id_str)
+            if bucket:
+                self._chat_buckets.move_to_end(chat_id_str)
+            else:
+                bucket = TokenBucket(self.chat_msgs_per_sec)
+                self._chat_buckets[chat_id_str] = bucket
+                if len(self._chat_buckets) > self.max_tracked_chats:
+                    self._chat_buckets.popitem(last=False)
+        return bucket
+
+    def wait(self, chat_id):
+        # per-chat limit goes first so that a busy chat doesn't hold a slot of the global limit while waiting
+        if chat_id is not None:
+            self.get_chat_bucket(chat_id).acquire()
+        self.global_bucket.acquire()
+
+    async def wait_async(self, chat_id):
+        if chat_id is not None:
+            await self.get_chat_bucket(chat_id).acquire_async()
+        await self.global_bucket.acquire_async()
+
+    def pause(self, seconds):
+        self.global_bucket.pause(seconds)
+
+
+class BroadcastAborted(SwiperError):
+    ...
+
+
+class BroadcastResult:
+    def __init__(self, receiver, chat_id, value=None, error=None):
+        self.receiver = receiver
+        self.chat_id = chat_id
+        self.value = value
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None and bool(self.value)
+
+    def __repr__(self):
+        return f"BroadcastResult(chat_id={self.chat_id!r}, value={self.value!r}, error={self.error!r})"
+
+
+def log_failed_results(results):
+    failed_results = [
+        result for result in results if not result.succeeded and not isinstance(result.error, BroadcastAborted)
+    ]
+    if failed_results:
+        logger.warning(
+            'BROADCAST: %s out of %s receivers were not reached: %s',
+            len(failed_results),
+            len(results),
+            failed_results,
+        )
+
+
+class Broadcaster:
+    """
+    Sends to many receivers concurrently using a pool of worker threads while obeying Telegram limits. One receiver
+    failing (blocked the bot, deleted the chat etc.) doesn't affect the rest of the broadcast.
+    """
+
+    def __init__(self, max_workers=BROADCAST_MAX_WORKERS, rate_limiter=None):
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or TelegramRateLimiter()
+
+        # the pool is kept for the lifetime of the process (warm lambda containers reuse it)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='broadcaster')
+
+    def broadcast(self, receivers, send_func, get_chat_id=None, should_abort=None):
+        """
+        Calls `send_func(receiver)` for every receiver and returns a list of BroadcastResult objects (in the order of
+        receivers). `receivers` may be a lazy iterable - it is consumed gradually, no more than `max_workers` sends
+        are in flight at any given moment. Once `should_abort()` returns True the remaining receivers are skipped
+        (their results carry BroadcastAborted error).
+        """
+        in_flight = threading.BoundedSemaphore(self.max_workers)
+
+        def _release(_future):
+            in_flight.release()
+
+        futures = []
+        for receiver in receivers:
+            chat_id = get_chat_id(receiver) if get_chat_id else receiver
+
+            in_flight.acquire()
+            future = submit_in_context(self._executor, self._send, receiver, chat_id, send_func, should_abort)
+            future.add_done_callback(_release)
+            futures.append(future)
+
+        results = [future.result() for future in futures]
+        log_failed_results(results)
+        return results
+
+    def _send(self, receiver, chat_id, send_func, should_abort):
+        retry_after_attempts = 0
+        while True:
+            if should_abort and should_abort():
+                return BroadcastResult(receiver, chat_id, error=BroadcastAborted())
+
+            self.rate_limiter.wait(chat_id)
+            try:
+                return BroadcastResult(receiver, chat_id, value=send_func(receiver))
+
+            except RetryAfter as e:
+                retry_after_attempts += 1
+                if retry_after_attempts > MAX_RETRY_AFTER_ATTEMPTS:
+                    logger.warning('BROADCAST: giving up on chat_id=%s after flood control errors', chat_id)
+                    return BroadcastResult(receiver, chat_id, error=e)
+
+                logger.warning('BROADCAST: flood control exceeded, retrying in %s seconds', e.retry_after)
+                # flood control applies to the whole bot, hence the global pause
+                self.rate_limiter.pause(e.retry_after)
+
+            except Exception as e:
+                logger.warning('BROADCAST: failed to send to chat_id=%s', chat_id, exc_info=True)
+                return BroadcastResult(receiver, chat_id, error=e)
+
+
+_NO_MORE_RECEIVERS = object()
+
+
+class AsyncBroadcaster(Broadcaster):
+    """
+    Broadcaster whose fan-out runs on an asyncio event loop as gathered tasks (no more than `max_tasks` of them at any
+    given moment). Waiting for rate limits costs no thread - pool threads are only occupied by the blocking calls
+    themselves (PTB Bot API requests and boto3), which are offloaded to a pool of `max_tasks` threads (rather than
+    BROADCAST_MAX_WORKERS of the blocking mode). Lazy receivers are read by a pool of their own, one receiver ahead,
+    so reading the next page of receivers never waits behind the sends.
+
+    broadcast() keeps the blocking interface of Broadcaster (it is called by PTB handlers) and may be called from any
+    thread except the one of the loop.
+    """
+
+    def __init__(self, loop, max_tasks=ASYNC_BROADCAST_MAX_TASKS, rate_limiter=None):
+        super().__init__(max_workers=max_tasks, rate_limiter=rate_limiter)
+        self.loop = loop
+        self.max_tasks = max_tasks
+
+        self._receivers_executor = ThreadPoolExecutor(
+            max_workers=RECEIVERS_READER_WORKERS,
+            thread_name_prefix='broadcast-receivers',
+        )
+
+    def broadcast(self, receivers, send_func, get_chat_id=None, should_abort=None):
+        # tasks scheduled with run_coroutine_threadsafe() run in a copy of the caller's context, hence they (and the
+        # work they offload) see the update being processed
+        return asyncio.run_coroutine_threadsafe(
+            self.broadcast_async(receivers, send_func, get_chat_id=get_chat_id, should_abort=should_abort),
+            self.loop,
+        ).result()
+
+    def _read_next_receiver(self, receivers_iterator):
+        # lazy receivers may be read from DDB page by page
+        return asyncio.ensure_future(
+            offload(self._receivers_executor, next, receivers_iterator, _NO_MORE_RECEIVERS)
+        )
+
+    async def broadcast_async(self, receivers, send_func, get_chat_id=None, should_abort=None):
+        in_flight = asyncio.Semaphore(self.max_tasks)
+
+        def _release(_task):
+            in_flight.release()
+
+        receivers_iterator = iter(receivers)
+        next_receiver = self._read_next_receiver(receivers_iterator)
+        tasks = []
+        while True:
+            receiver = await next_receiver
+            if receiver is _NO_MORE_RECEIVERS:
+                break
+            # the next receiver is being read while this one waits for a free slot
+            next_receiver = self._read_next_receiver(receivers_iterator)
+            chat_id = get_chat_id(receiver) if get_chat_id else receiver
+
+            await in_flight.acquire()
+            task = asyncio.ensure_future(self._send_async(receiver, chat_id, send_func, should_abort))
+            task.add_done_callback(_release)
+            tasks.append(task)
+
+        results = await asyncio.gather(*tasks)
+        log_failed_results(results)
+        return results
+
+    async def _send_async(self, receiver, chat_id, send_func, should_abort):
+        retry_after_attempts = 0
+        while True:
+            if should_abort and await offload(self._executor, should_abort):
+                return BroadcastResult(receiver, chat_id, error=BroadcastAborted())
+
+            await self.rate_limiter.wait_async(chat_id)
+            try:
+                return BroadcastResult(receiver, chat_id, value=await offload(self._executor, send_func, receiver))
+
+            except RetryAfter as e:
+                retry_after_attempts += 1
+                if retry_after_attempts > MAX_RETRY_AFTER_ATTEMPTS:
+                    logger.warning('BROADCAST: giving up on chat_id=%s after flood control errors', chat_id)
+                    return BroadcastResult(receiver, chat_id, error=e)
+
+                logger.warning('BROADCAST: flood control exceeded, retrying in %s seconds', e.retry_after)
+                self.rate_limiter.pause(e.retry_after)
+
+            except Exception as e:
+                logger.warning('BROADCAST: failed to send to chat_id=%s', chat_id, exc_info=True)
+                return BroadcastResult(receiver, chat_id, error=e)
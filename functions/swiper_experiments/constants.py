@@ -4,6 +4,23 @@ from distutils.util import strtobool
 # TODO oleksandr: rename to NEW_TOPICS_ARE_SILENT ?
 BLACK_HEARTS_ARE_SILENT = bool(strtobool(os.environ['BLACK_HEARTS_ARE_SILENT']))
 
+# read records that were keyed by a legacy scheme as well (until all of them are backfilled)
+LEGACY_DDB_KEY_READS = bool(strtobool(os.environ['LEGACY_DDB_KEY_READS']))
+
+# receiver message -> transmission lookups (0 disables the cache)
+TRANSMISSIONS_CACHE_TTL_SEC = float(os.environ['TRANSMISSIONS_CACHE_TTL_SEC'])
+TRANSMISSIONS_CACHE_MAX_SIZE = int(os.environ['TRANSMISSIONS_CACHE_MAX_SIZE'])
+
+BROADCAST_MAX_WORKERS = int(os.environ['BROADCAST_MAX_WORKERS'])
+# asyncio processing mode: fan-outs run as tasks on an event loop (blocking calls are still offloaded to threads)
+ASYNC_PROCESSING = bool(strtobool(os.environ['ASYNC_PROCESSING']))
+ASYNC_BROADCAST_MAX_TASKS = int(os.environ['ASYNC_BROADCAST_MAX_TASKS'])
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+TELEGRAM_GLOBAL_MSGS_PER_SEC = float(os.environ['TELEGRAM_GLOBAL_MSGS_PER_SEC'])
+TELEGRAM_CHAT_MSGS_PER_SEC = float(os.environ['TELEGRAM_CHAT_MSGS_PER_SEC'])
+TELEGRAM_CONNECT_TIMEOUT_SEC = float(os.environ['TELEGRAM_CONNECT_TIMEOUT_SEC'])
+TELEGRAM_READ_TIMEOUT_SEC = float(os.environ['TELEGRAM_READ_TIMEOUT_SEC'])
+
 
 class CallbackData:
     REPLY = 'reply'
@@ -28,6 +45,28 @@ class Texts:
     MESSAGE_NOT_TRANSMITTED = f"<i>Повідомлення не відправлено 😞\n/{Commands.HELP}</i>"
     FAILED_TO_EDIT_AT_RECEIVER = f"<i>Не вдалося відредагувати у отримувача 😞\n/{Commands.HELP}</i>"
 
+    @staticmethod
+    def get_failed_to_edit_at_receiver_msg(failed_num, receivers_num):
+        if receivers_num < 2:
+            return Texts.FAILED_TO_EDIT_AT_RECEIVER
+
+        _failed_to_edit = (
+            f"<i>Не вдалося відредагувати у {failed_num} з {receivers_num} отримувачів 😞\n"
+            f"/{Commands.HELP}</i>"
+        )
+        return _failed_to_edit.strip()
+
+    @staticmethod
+    def get_not_transmitted_to_receivers_msg(failed_num, receivers_num):
+        if failed_num >= receivers_num:
+            return Texts.MESSAGE_NOT_TRANSMITTED
+
+        _not_transmitted = (
+            f"<i>Повідомлення не відправлено {failed_num} з {receivers_num} отримувачів 😞\n"
+            f"/{Commands.HELP}</i>"
+        )
+        return _not_transmitted.strip()
+
     @staticmethod
     def get_new_topic_started_msg(username):
         _new_topic_started = (
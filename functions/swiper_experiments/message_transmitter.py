@@ -1,19 +1,29 @@
-from pprint import pformat
+from collections import Counter
+from functools import lru_cache
 
 from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ForceReply
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Unauthorized
 
 from functions.common import logging  # force log config of functions/common/__init__.py
-from functions.common.dynamodb import msg_transmission_table, DdbFields, topic_table, allogrooming_table
-from functions.common.s3 import put_s3_object, main_bucket
-from functions.common.utils import fail_safely, generate_uuid
-from functions.swiper_experiments.constants import CallbackData, Texts, BLACK_HEARTS_ARE_SILENT
+from functions.common.cache import TtlLruCache
+from functions.common.dynamodb import msg_transmission_table, DdbFields, topic_table, allogrooming_table, \
+    compose_ddb_key, query_items, compose_projection
+from functions.common.utils import fail_safely, generate_uuid, peek_items
+from functions.swiper_experiments.broadcaster import BroadcastAborted
+from functions.swiper_experiments.constants import CallbackData, Texts, BLACK_HEARTS_ARE_SILENT, \
+    LEGACY_DDB_KEY_READS, TRANSMISSIONS_CACHE_TTL_SEC, TRANSMISSIONS_CACHE_MAX_SIZE
 from functions.swiper_experiments.swiper_usernames import append_swiper_username
 
 logger = logging.getLogger(__name__)
 
+# (receiver_bot_id, receiver_chat_id, receiver_msg_id) -> msg transmission; pressing "Reply" and then answering looks
+# the same transmission up twice within seconds
+msg_transmissions_cache = TtlLruCache(ttl_sec=TRANSMISSIONS_CACHE_TTL_SEC, max_size=TRANSMISSIONS_CACHE_MAX_SIZE)
 
+
+@lru_cache(maxsize=None)  # only two variants of it exist, and they are shared by all the transmissions
 def transmission_kbd_markup(red_heart):
     if red_heart:
         heart = Texts.READ_HEART
@@ -25,6 +35,25 @@ def transmission_kbd_markup(red_heart):
     return kbd_markup
 
 
+def compose_msg_transmission_id(receiver_msg_id, receiver_chat_id, receiver_bot_id):
+    return compose_ddb_key(int(receiver_bot_id), int(receiver_chat_id), int(receiver_msg_id))
+
+
+def cache_msg_transmission(msg_transmission):
+    """
+    To be called only with msg transmissions that are persisted already.
+    """
+    msg_transmissions_cache.put(
+        (
+            int(msg_transmission[DdbFields.RECEIVER_BOT_ID]),
+            int(msg_transmission[DdbFields.RECEIVER_CHAT_ID]),
+            int(msg_transmission[DdbFields.RECEIVER_MSG_ID]),
+        ),
+        # the caller may keep modifying its own copy
+        dict(msg_transmission),
+    )
+
+
 def find_original_transmission(
         receiver_msg_id,
         receiver_chat_id,
@@ -34,19 +63,33 @@ def find_original_transmission(
     receiver_chat_id = int(receiver_chat_id)
     receiver_bot_id = int(receiver_bot_id)
 
-    # TODO oleksandr: paginate ?
-    scan_result = msg_transmission_table.query(
-        IndexName='byReceiverMsgId',
-        KeyConditionExpression=(
-                Key(DdbFields.RECEIVER_MSG_ID).eq(receiver_msg_id) &
-                Key(DdbFields.RECEIVER_CHAT_ID).eq(receiver_chat_id)
-        ),
-        FilterExpression=Attr(DdbFields.RECEIVER_BOT_ID).eq(receiver_bot_id),
+    msg_transmission = msg_transmissions_cache.get((receiver_bot_id, receiver_chat_id, receiver_msg_id))
+    if msg_transmission:
+        return dict(msg_transmission)
+
+    msg_transmission_id = compose_msg_transmission_id(
+        receiver_msg_id=receiver_msg_id,
+        receiver_chat_id=receiver_chat_id,
+        receiver_bot_id=receiver_bot_id,
+    )
+    response = msg_transmission_table.get_item(
+        Key={
+            DdbFields.ID: msg_transmission_id,
+        },
+        ConsistentRead=True,
     )
     if logger.isEnabledFor(logging.INFO):
-        logger.info('FIND ORIGINAL TRANSMISSION (DDB QUERY RESPONSE):\n%s', scan_result)
+        logger.info('FIND ORIGINAL TRANSMISSION (DDB GET_ITEM RESPONSE):\n%s', response)
+
+    msg_transmission = response.get('Item')
+    if not msg_transmission and LEGACY_DDB_KEY_READS:
+        msg_transmission = _find_legacy_original_transmission(
+            receiver_msg_id=receiver_msg_id,
+            receiver_chat_id=receiver_chat_id,
+            receiver_bot_id=receiver_bot_id,
+        )
 
-    if not scan_result['Items']:
+    if not msg_transmission:
         logger.info(
             'FIND ORIGINAL TRANSMISSION: no DDB result was found for '
             'receiver_msg_id=%s ; receiver_chat_id=%s ; receiver_bot_id=%s',
@@ -55,7 +98,33 @@ def find_original_transmission(
             receiver_bot_id,
         )
         return None
-    if len(scan_result['Items']) > 1:
+
+    cache_msg_transmission(msg_transmission)
+    return dict(msg_transmission)
+
+
+def _find_legacy_original_transmission(
+        receiver_msg_id,
+        receiver_chat_id,
+        receiver_bot_id,
+):
+    """
+    Transmissions that were created before their ids were derived from receiver ids (and haven't been backfilled yet).
+    """
+    # the match may be on any page (FilterExpression is applied after a page is read), hence no Limit
+    items, _ = peek_items(query_items(
+        msg_transmission_table,
+        IndexName='byReceiverMsgId',
+        KeyConditionExpression=(
+                Key(DdbFields.RECEIVER_MSG_ID).eq(receiver_msg_id) &
+                Key(DdbFields.RECEIVER_CHAT_ID).eq(receiver_chat_id)
+        ),
+        FilterExpression=Attr(DdbFields.RECEIVER_BOT_ID).eq(receiver_bot_id),
+    ), 2)
+
+    if not items:
+        return None
+    if len(items) > 1:
         logger.warning(
             'FIND ORIGINAL TRANSMISSION: MORE THAN ONE DDB RESULT was found for '
             'receiver_msg_id=%s ; receiver_chat_id=%s ; receiver_bot_id=%s',
@@ -63,7 +132,24 @@ def find_original_transmission(
             receiver_chat_id,
             receiver_bot_id,
         )
-    return scan_result['Items'][0]
+    return items[0]
+
+
+# what handlers need to propagate edits and replies to the receivers of a message (must be kept in line with the
+# projection of bySenderMsgKey index in serverless.yml)
+TRANSMISSION_RECEIVER_FIELDS = (
+    DdbFields.ID,
+    DdbFields.RECEIVER_MSG_ID,
+    DdbFields.RECEIVER_CHAT_ID,
+    DdbFields.RECEIVER_BOT_ID,
+    DdbFields.RED_HEART,
+    DdbFields.TOPIC_ID,
+    DdbFields.ALLOGROOMING_ID,
+)
+
+
+def compose_sender_msg_key(sender_msg_id, sender_chat_id, sender_bot_id):
+    return compose_ddb_key(int(sender_bot_id), int(sender_chat_id), int(sender_msg_id))
 
 
 def find_transmissions_by_sender_msg(
@@ -71,23 +157,41 @@ def find_transmissions_by_sender_msg(
         sender_chat_id,
         sender_bot_id,
 ):
+    """
+    Lazy generator - the pages of the query are read as the transmissions are consumed (a broadcast may have reached
+    thousands of receivers, which is more than one page of results). Only TRANSMISSION_RECEIVER_FIELDS are returned.
+    """
     sender_msg_id = int(sender_msg_id)
     sender_chat_id = int(sender_chat_id)
     sender_bot_id = int(sender_bot_id)
 
-    scan_result = msg_transmission_table.query(
-        IndexName='bySenderMsgId',
-        KeyConditionExpression=(
-                Key(DdbFields.SENDER_MSG_ID).eq(sender_msg_id) &
-                Key(DdbFields.SENDER_CHAT_ID).eq(sender_chat_id)
-        ),
-        FilterExpression=Attr(DdbFields.SENDER_BOT_ID).eq(sender_bot_id),
-    )
-    if logger.isEnabledFor(logging.INFO):  # TODO oleksandr: this logging is redundant - get rid of it
-        logger.info('FIND TRANSMISSION (DDB QUERY RESPONSE):\n%s', pformat(scan_result))
-
-    items = scan_result['Items']
-    if not items:
+    found_ids = set()
+    for item in query_items(
+            msg_transmission_table,
+            IndexName='bySenderMsgKey',
+            KeyConditionExpression=Key(DdbFields.SENDER_MSG_KEY).eq(compose_sender_msg_key(
+                sender_msg_id=sender_msg_id,
+                sender_chat_id=sender_chat_id,
+                sender_bot_id=sender_bot_id,
+            )),
+            **compose_projection(*TRANSMISSION_RECEIVER_FIELDS),
+    ):
+        found_ids.add(item[DdbFields.ID])
+        yield item
+
+    if LEGACY_DDB_KEY_READS:
+        # not only when nothing was found by the new key: some of the legacy transmissions of the message may have got
+        # sender_msg_key already (backfill in progress, force_reply() copies etc.), the rest can be found only here
+        for item in _find_legacy_transmissions_by_sender_msg(
+                sender_msg_id=sender_msg_id,
+                sender_chat_id=sender_chat_id,
+                sender_bot_id=sender_bot_id,
+        ):
+            if item[DdbFields.ID] not in found_ids:
+                found_ids.add(item[DdbFields.ID])
+                yield item
+
+    if not found_ids:
         logger.info(  # TODO oleksandr: this logging is redundant - get rid of it
             'FIND TRANSMISSIONS BY SENDER MSG: no DDB results were found for '
             'sender_msg_id=%s ; sender_chat_id=%s ; sender_bot_id=%s',
@@ -95,7 +199,26 @@ def find_transmissions_by_sender_msg(
             sender_chat_id,
             sender_bot_id,
         )
-    return items
+
+
+def _find_legacy_transmissions_by_sender_msg(
+        sender_msg_id,
+        sender_chat_id,
+        sender_bot_id,
+):
+    """
+    Transmissions that were created before sender_msg_key was introduced (and haven't been backfilled yet).
+    """
+    return query_items(
+        msg_transmission_table,
+        IndexName='bySenderMsgId',
+        KeyConditionExpression=(
+                Key(DdbFields.SENDER_MSG_ID).eq(sender_msg_id) &
+                Key(DdbFields.SENDER_CHAT_ID).eq(sender_chat_id)
+        ),
+        FilterExpression=Attr(DdbFields.SENDER_BOT_ID).eq(sender_bot_id),
+        **compose_projection(*TRANSMISSION_RECEIVER_FIELDS),
+    )
 
 
 def create_topic(
@@ -123,17 +246,34 @@ def create_topic(
     return topic_id
 
 
-def find_allogrooming(
+def compose_topic_sender_receiver_key(
+        topic_id,
         sender_chat_id,
         sender_bot_id,
         receiver_chat_id,
         receiver_bot_id,
-        topic_id,
 ):
-    sender_chat_id = int(sender_chat_id)
-    sender_bot_id = int(sender_bot_id)
+    return compose_ddb_key(
+        topic_id,
+        int(sender_bot_id),
+        int(sender_chat_id),
+        int(receiver_bot_id),
+        int(receiver_chat_id),
+    )
+
 
-    scan_result = allogrooming_table.query(
+def _find_legacy_allogroomings(
+        sender_chat_id,
+        sender_bot_id,
+        receiver_chat_id,
+        receiver_bot_id,
+        topic_id,
+):
+    """
+    Allogroomings that were created with random ids (and haven't been re-keyed yet).
+    """
+    return query_items(
+        allogrooming_table,
         IndexName='byTopicAndSender',
         KeyConditionExpression=(
                 Key(DdbFields.TOPIC_ID).eq(topic_id) &
@@ -144,27 +284,11 @@ def find_allogrooming(
                 Attr(DdbFields.RECEIVER_CHAT_ID).eq(receiver_chat_id) &
                 Attr(DdbFields.RECEIVER_BOT_ID).eq(receiver_bot_id)
         ),
+        **compose_projection(DdbFields.ID),
     )
-    if logger.isEnabledFor(logging.INFO):  # TODO oleksandr: this logging is redundant - get rid of it
-        logger.info('FIND ALLOGROOMING (DDB QUERY RESPONSE):\n%s', scan_result)
-
-    items = scan_result['Items']
-    if items:
-        if len(items) > 1:
-            logger.warning(
-                'FOUND MORE THAN ONE ALLOGROOMING BY TOPIC AND SENDER: '
-                'topic_id=%s ; sender_chat_id=%s ; sender_bot_id=%s ; receiver_chat_id=%s ; receiver_bot_id=%s',
-                topic_id,
-                sender_chat_id,
-                sender_bot_id,
-                receiver_chat_id,
-                receiver_bot_id,
-            )
-        return items[0]
-    return None
 
 
-def create_allogrooming(
+def upsert_allogrooming(
         swiper_update,
         msg,
         sender_bot_id,
@@ -172,6 +296,10 @@ def create_allogrooming(
         receiver_bot_id,
         topic_id,
 ):
+    """
+    Creates an allogrooming unless it exists already - in one conditional write (no race between concurrent first
+    replies). Allogrooming id is derived from topic, sender and receiver. Returns a tuple (allogrooming_id, is_new).
+    """
     sender_msg_id = int(msg.message_id)
     sender_chat_id = int(msg.chat_id)
     sender_bot_id = int(sender_bot_id)
@@ -179,9 +307,14 @@ def create_allogrooming(
     receiver_chat_id = int(receiver_chat_id)
     receiver_bot_id = int(receiver_bot_id)
 
-    allogrooming_id = generate_uuid()
+    allogrooming_id = compose_topic_sender_receiver_key(
+        topic_id=topic_id,
+        sender_chat_id=sender_chat_id,
+        sender_bot_id=sender_bot_id,
+        receiver_chat_id=receiver_chat_id,
+        receiver_bot_id=receiver_bot_id,
+    )
     allogrooming = {
-        DdbFields.ID: allogrooming_id,
         DdbFields.TOPIC_ID: topic_id,
 
         DdbFields.SENDER_MSG_ID: sender_msg_id,
@@ -193,14 +326,69 @@ def create_allogrooming(
 
         DdbFields.SENDER_UPDATE_S3_KEY: swiper_update.telegram_update_s3_key,
     }
-    allogrooming_table.put_item(
-        Item=allogrooming,
+    stored_allogrooming = None
+    legacy_allogrooming_id = None
+    if LEGACY_DDB_KEY_READS:
+        # allogroomings that exist under the derived id already (every reply but the first one of a pair, and the ones
+        # re-keyed by jupyter_sandbox/backfill-allogrooming-ids.ipynb) don't need the legacy lookup
+        stored_allogrooming = _update_allogrooming(allogrooming_id, allogrooming, only_existing=True)
+
+    if stored_allogrooming is None and LEGACY_DDB_KEY_READS:
+        # looked up before the write (rather than after it turned out to be the first one), so that the legacy id is
+        # recorded in the same conditional write that creates the allogrooming - concurrent first replies can't
+        # resolve to different ids this way (legacy allogroomings are not created anymore, all of them see the same)
+        legacy_allogrooming_ids = [
+            item[DdbFields.ID] for item in _find_legacy_allogroomings(
+                sender_chat_id=sender_chat_id,
+                sender_bot_id=sender_bot_id,
+                receiver_chat_id=receiver_chat_id,
+                receiver_bot_id=receiver_bot_id,
+                topic_id=topic_id,
+            ) if item[DdbFields.ID] != allogrooming_id
+        ]
+        if legacy_allogrooming_ids:
+            legacy_allogrooming_id = min(legacy_allogrooming_ids)
+            # next upserts will resolve to the legacy allogrooming straight away
+            allogrooming[DdbFields.LEGACY_ID] = legacy_allogrooming_id
+
+    if stored_allogrooming is None:
+        stored_allogrooming = _update_allogrooming(allogrooming_id, allogrooming)
+
+    is_new = (
+            legacy_allogrooming_id is None and
+            stored_allogrooming[DdbFields.SENDER_UPDATE_S3_KEY] == swiper_update.telegram_update_s3_key
     )
-    return allogrooming_id
+    return stored_allogrooming.get(DdbFields.LEGACY_ID) or allogrooming_id, is_new
+
+
+def _update_allogrooming(allogrooming_id, allogrooming, only_existing=False):
+    """
+    Returns the allogrooming as stored after the update (None if only_existing and it doesn't exist).
+    """
+    kwargs = {}
+    if only_existing:
+        kwargs['ConditionExpression'] = f"attribute_exists({DdbFields.ID})"
+    try:
+        response = allogrooming_table.update_item(
+            Key={
+                DdbFields.ID: allogrooming_id,
+            },
+            # values of the first reply are kept if the allogrooming exists already
+            UpdateExpression='SET ' + ', '.join(
+                f"{field} = if_not_exists({field}, :{field})" for field in allogrooming
+            ),
+            ExpressionAttributeValues={f":{field}": value for field, value in allogrooming.items()},
+            ReturnValues='ALL_NEW',
+            **kwargs,
+        )
+    except ClientError as e:
+        if not only_existing or e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+    return response['Attributes']
 
 
-@fail_safely()
-def transmit_message(
+def _transmit_message(
         swiper_update,
         msg,
         sender_bot_id,
@@ -211,6 +399,7 @@ def transmit_message(
         disable_notification,
         allogrooming_id=None,
         reply_to_msg_id=None,
+        prepared_transmission=None,
 ):
     sender_msg_id = int(msg.message_id)
     sender_chat_id = int(msg.chat_id)
@@ -223,11 +412,12 @@ def transmit_message(
     if reply_to_msg_id is not None:
         reply_to_msg_id = int(reply_to_msg_id)
 
-    transmitted_msg = _ptb_transmit(
-        msg=msg,
+    if not prepared_transmission:
+        prepared_transmission = PreparedTransmission(msg, swiper_update.current_swiper.swiper_username)
+
+    transmitted_msg = prepared_transmission.send(
         receiver_chat_id=receiver_chat_id,
         receiver_bot=receiver_bot,
-        username_to_append=swiper_update.current_swiper.swiper_username,
 
         reply_to_message_id=reply_to_msg_id,
         # TODO oleksandr: allow_sending_without_reply=True, ?
@@ -242,13 +432,10 @@ def transmit_message(
 
     receiver_msg_id = int(transmitted_msg.message_id)
 
-    msg_transmission_id = generate_uuid()
-
-    receiver_msg_s3_key = f"{swiper_update.update_s3_key_prefix}.transmission.{msg_transmission_id}.json"
-    put_s3_object(
-        s3_bucket=main_bucket,
-        key=receiver_msg_s3_key,
-        obj_dict=transmitted_msg.to_dict(),
+    msg_transmission_id = compose_msg_transmission_id(
+        receiver_msg_id=receiver_msg_id,
+        receiver_chat_id=receiver_chat_id,
+        receiver_bot_id=receiver_bot_id,
     )
 
     msg_transmission = {
@@ -264,14 +451,19 @@ def transmit_message(
         DdbFields.RECEIVER_CHAT_ID: receiver_chat_id,
         DdbFields.RECEIVER_BOT_ID: receiver_bot_id,
 
+        DdbFields.SENDER_MSG_KEY: compose_sender_msg_key(
+            sender_msg_id=sender_msg_id,
+            sender_chat_id=sender_chat_id,
+            sender_bot_id=sender_bot_id,
+        ),
+
         DdbFields.RED_HEART: red_heart,
 
         DdbFields.SENDER_UPDATE_S3_KEY: swiper_update.telegram_update_s3_key,
-        DdbFields.RECEIVER_MSG_S3_KEY: receiver_msg_s3_key,
+        **swiper_update.audit_transmission(msg_transmission_id, transmitted_msg.to_dict()),
     }
-    msg_transmission_table.put_item(
-        Item=msg_transmission,
-    )
+    # a transmission that fails to be written is not cached (it would be served for TRANSMISSIONS_CACHE_TTL_SEC)
+    swiper_update.write_msg_transmission(msg_transmission, on_persisted=cache_msg_transmission)
 
     if reply_to_msg_id is not None:
         try:
@@ -287,7 +479,50 @@ def transmit_message(
     return True
 
 
+transmit_message = fail_safely()(_transmit_message)
+
+
+def broadcast_message(
+        swiper_update,
+        broadcaster,
+        msg,
+        sender_bot_id,
+        receiver_bot,
+        receivers,
+        **kwargs,
+):
+    """
+    Transmits msg to many receivers concurrently. `receivers` is an iterable of dicts with `receiver_chat_id` and any
+    other per-receiver arguments of transmit_message(), kwargs are the arguments that are common for all receivers.
+    Returns a list of BroadcastResult objects (one per receiver).
+    """
+    # rendered once for all the receivers (this also resolves lazily initialized swiper data before the work is
+    # spread across threads)
+    prepared_transmission = PreparedTransmission(msg, swiper_update.current_swiper.swiper_username)
+
+    def _transmit(receiver):
+        return _transmit_message(
+            swiper_update=swiper_update,
+            msg=msg,
+            sender_bot_id=sender_bot_id,
+            receiver_bot=receiver_bot,
+            prepared_transmission=prepared_transmission,
+            **{**kwargs, **receiver},
+        )
+
+    return broadcaster.broadcast(
+        receivers,
+        _transmit,
+        get_chat_id=lambda receiver: receiver['receiver_chat_id'],
+    )
+
+
 def force_reply(original_msg, original_msg_transmission):
+    """
+    Re-sends original_msg with ForceReply markup, moves its msg transmission over to the new message (one DDB
+    transaction) and deletes original_msg once the transaction succeeds. If the transaction fails, the ForceReply copy
+    is deleted instead (original_msg and its transmission stay as they were).
+    """
     if original_msg.reply_to_message:
         reply_to_msg_id = original_msg.reply_to_message.message_id
     else:
@@ -307,22 +542,54 @@ def force_reply(original_msg, original_msg_transmission):
 
     msg_trans_copy = original_msg_transmission.copy()
     msg_trans_copy[DdbFields.ORIGINAL_MSG_TRANS_ID] = original_msg_transmission[DdbFields.ID]
-    msg_trans_copy[DdbFields.ID] = generate_uuid()
+    msg_trans_copy.pop(DdbFields.LEGACY_ID, None)
+    msg_trans_copy[DdbFields.SENDER_MSG_KEY] = compose_sender_msg_key(
+        sender_msg_id=original_msg_transmission[DdbFields.SENDER_MSG_ID],
+        sender_chat_id=original_msg_transmission[DdbFields.SENDER_CHAT_ID],
+        sender_bot_id=original_msg_transmission[DdbFields.SENDER_BOT_ID],
+    )
 
     msg_trans_copy[DdbFields.RECEIVER_MSG_ID] = int(force_reply_msg.message_id)
     msg_trans_copy[DdbFields.RECEIVER_CHAT_ID] = int(force_reply_msg.chat.id)
     msg_trans_copy[DdbFields.RECEIVER_BOT_ID] = int(force_reply_msg.bot.id)
-
-    msg_transmission_table.put_item(
-        Item=msg_trans_copy,
+    msg_trans_copy[DdbFields.ID] = compose_msg_transmission_id(
+        receiver_msg_id=msg_trans_copy[DdbFields.RECEIVER_MSG_ID],
+        receiver_chat_id=msg_trans_copy[DdbFields.RECEIVER_CHAT_ID],
+        receiver_bot_id=msg_trans_copy[DdbFields.RECEIVER_BOT_ID],
     )
 
-    # TODO oleksandr: switch to soft deletes ?
-    msg_transmission_table.delete_item(
-        Key={
-            DdbFields.ID: original_msg_transmission[DdbFields.ID],
-        },
-    )
+    try:
+        msg_transmission_table.meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': msg_transmission_table.name,
+                        'Item': msg_trans_copy,
+                    },
+                },
+                {
+                    'Delete': {
+                        'TableName': msg_transmission_table.name,
+                        'Key': {
+                            DdbFields.ID: original_msg_transmission[DdbFields.ID],
+                        },
+                    },
+                },
+            ],
+        )
+    except Exception:
+        # the copy would have no transmission to reply through (failing to delete it must not hide the original error)
+        fail_safely()(force_reply_msg.delete)()
+        raise
+
+    msg_transmissions_cache.invalidate((
+        int(original_msg_transmission[DdbFields.RECEIVER_BOT_ID]),
+        int(original_msg_transmission[DdbFields.RECEIVER_CHAT_ID]),
+        int(original_msg_transmission[DdbFields.RECEIVER_MSG_ID]),
+    ))
+    cache_msg_transmission(msg_trans_copy)
+
+    original_msg.delete()
 
 
 def prepare_msg_for_transmission(msg, sender_bot, **kwargs):
@@ -351,159 +618,196 @@ def prepare_msg_for_transmission(msg, sender_bot, **kwargs):
     return msg
 
 
-def _ptb_transmit(msg, receiver_chat_id, receiver_bot, username_to_append, **kwargs):
-    transmitted_msg = None
+class PreparedTransmission:
+    """
+    A message rendered for transmission once (text/caption with swiper username appended, entities, media reference)
+    so that sending it to every next receiver costs only the request itself.
+    """
+
+    def __init__(self, msg, username_to_append):
+        self.msg = msg
 
-    def _append_username_or_dont(_text, _entities):
+        self.text = None
+        self.entities = None
+        if msg.text:
+            self.text, self.entities = self._append_username_or_dont(msg.text, msg.entities, username_to_append)
+        elif msg.photo or msg.animation or msg.video or msg.audio or msg.voice or msg.document:
+            self.text, self.entities = self._append_username_or_dont(
+                msg.caption, msg.caption_entities, username_to_append
+            )
+
+        self.send_method_name, self.send_kwargs = self._prepare_send_kwargs()
+
+    @staticmethod
+    def _append_username_or_dont(text, entities, username_to_append):
         if username_to_append:
-            return append_swiper_username(_text, _entities, username_to_append)
-        return _text, _entities
-
-    if msg.text:
-        text, entities = _append_username_or_dont(msg.text, msg.entities)
-        transmitted_msg = receiver_bot.send_message(
-            chat_id=receiver_chat_id,
-            text=text,
-            entities=entities,
-            **kwargs,
-        )
+            return append_swiper_username(text, entities, username_to_append)
+        return text, entities
 
-    elif msg.sticker:
-        transmitted_msg = receiver_bot.send_sticker(
-            chat_id=receiver_chat_id,
-            sticker=msg.sticker,
-            **kwargs,
-        )
+    def _prepare_send_kwargs(self):
+        msg = self.msg
 
-    elif msg.photo:
-        biggest_photo = max(msg.photo, key=lambda p: p['file_size'])
-        if logger.isEnabledFor(logging.INFO):
-            logger.info('BIGGEST PHOTO SIZE:\n%s', biggest_photo.to_dict())
-
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_photo(
-            chat_id=receiver_chat_id,
-            photo=biggest_photo,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.text:
+            return 'send_message', {'text': self.text, 'entities': self.entities}
 
-    elif msg.animation:
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_animation(
-            chat_id=receiver_chat_id,
-            animation=msg.animation,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.sticker:
+            return 'send_sticker', {'sticker': msg.sticker}
 
-    elif msg.video:
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_video(
-            chat_id=receiver_chat_id,
-            video=msg.video,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.photo:
+            biggest_photo = max(msg.photo, key=lambda p: p['file_size'])
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('BIGGEST PHOTO SIZE:\n%s', biggest_photo.to_dict())
+            return 'send_photo', {'photo': biggest_photo, 'caption': self.text, 'caption_entities': self.entities}
 
-    elif msg.audio:
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_audio(
-            chat_id=receiver_chat_id,
-            audio=msg.audio,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.animation:
+            return 'send_animation', {
+                'animation': msg.animation, 'caption': self.text, 'caption_entities': self.entities,
+            }
 
-    elif msg.video_note:
-        transmitted_msg = receiver_bot.send_video_note(
-            chat_id=receiver_chat_id,
-            video_note=msg.video_note,
-            **kwargs,
-        )
+        if msg.video:
+            return 'send_video', {'video': msg.video, 'caption': self.text, 'caption_entities': self.entities}
 
-    elif msg.voice:
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_voice(
-            chat_id=receiver_chat_id,
-            voice=msg.voice,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.audio:
+            return 'send_audio', {'audio': msg.audio, 'caption': self.text, 'caption_entities': self.entities}
 
-    elif msg.location:
-        transmitted_msg = receiver_bot.send_location(
-            chat_id=receiver_chat_id,
-            location=msg.location,
-            **kwargs,
-        )
+        if msg.video_note:
+            return 'send_video_note', {'video_note': msg.video_note}
 
-    elif msg.contact:
-        transmitted_msg = receiver_bot.send_contact(
-            chat_id=receiver_chat_id,
-            contact=msg.contact,
-            **kwargs,
-        )
+        if msg.voice:
+            return 'send_voice', {'voice': msg.voice, 'caption': self.text, 'caption_entities': self.entities}
 
-    elif msg.document:
-        text, entities = _append_username_or_dont(msg.caption, msg.caption_entities)
-        transmitted_msg = receiver_bot.send_document(
-            chat_id=receiver_chat_id,
-            document=msg.document,
-            caption=text,
-            caption_entities=entities,
-            **kwargs,
-        )
+        if msg.location:
+            return 'send_location', {'location': msg.location}
 
-    elif msg.poll:
-        transmitted_msg = receiver_bot.forward_message(
-            chat_id=receiver_chat_id,
-            from_chat_id=msg.chat_id,
-            message_id=msg.message_id,
-            disable_notification=BLACK_HEARTS_ARE_SILENT,  # poll with a read heart does not make much sense
-        )
+        if msg.contact:
+            return 'send_contact', {'contact': msg.contact}
 
-    return transmitted_msg
+        if msg.document:
+            return 'send_document', {
+                'document': msg.document, 'caption': self.text, 'caption_entities': self.entities,
+            }
 
+        if msg.poll:
+            return 'forward_message', {
+                'from_chat_id': msg.chat_id,
+                'message_id': msg.message_id,
+                'disable_notification': BLACK_HEARTS_ARE_SILENT,  # poll with a read heart does not make much sense
+            }
 
-@fail_safely()
-def edit_transmission(swiper_update, msg, receiver_msg_id, receiver_chat_id, receiver_bot, red_heart, **kwargs):
-    receiver_msg_id = int(receiver_msg_id)
-    receiver_chat_id = int(receiver_chat_id)
+        return None, None
 
-    swiper_username = swiper_update.current_swiper.swiper_username
-    edited_msg = None
-
-    if msg.text:
-        text, entities = append_swiper_username(msg.text, msg.entities, swiper_username)
-        edited_msg = receiver_bot.edit_message_text(
-            chat_id=receiver_chat_id,
-            message_id=receiver_msg_id,
-            text=text,
-            entities=entities,
-            reply_markup=transmission_kbd_markup(
-                red_heart=red_heart,
-            ),
-            **kwargs,
-        )
+    def send(self, receiver_chat_id, receiver_bot, **kwargs):
+        if not self.send_method_name:
+            return None
 
-    elif msg.caption:
-        text, entities = append_swiper_username(msg.caption, msg.caption_entities, swiper_username)
-        edited_msg = receiver_bot.edit_message_caption(
-            chat_id=receiver_chat_id,
-            message_id=receiver_msg_id,
-            caption=text,
-            caption_entities=entities,
-            reply_markup=transmission_kbd_markup(
-                red_heart=red_heart,
-            ),
-            **kwargs,
-        )
-        # TODO oleksandr: report to the user somehow that only caption was edited and not the media itself
+        if self.send_method_name == 'forward_message':
+            kwargs = {}  # forwarded message can't be decorated
+
+        send_method = getattr(receiver_bot, self.send_method_name)
+        return send_method(chat_id=receiver_chat_id, **self.send_kwargs, **kwargs)
+
+    def edit(self, receiver_msg_id, receiver_chat_id, receiver_bot, red_heart, **kwargs):
+        if self.msg.text:
+            return receiver_bot.edit_message_text(
+                chat_id=receiver_chat_id,
+                message_id=receiver_msg_id,
+                text=self.text,
+                entities=self.entities,
+                reply_markup=transmission_kbd_markup(
+                    red_heart=red_heart,
+                ),
+                **kwargs,
+            )
+
+        if self.msg.caption:
+            # TODO oleksandr: report to the user somehow that only caption was edited and not the media itself
+            return receiver_bot.edit_message_caption(
+                chat_id=receiver_chat_id,
+                message_id=receiver_msg_id,
+                caption=self.text,
+                caption_entities=self.entities,
+                reply_markup=transmission_kbd_markup(
+                    red_heart=red_heart,
+                ),
+                **kwargs,
+            )
+
+        return None
+
+
+def _ptb_transmit(msg, receiver_chat_id, receiver_bot, username_to_append, **kwargs):
+    return PreparedTransmission(msg, username_to_append).send(receiver_chat_id, receiver_bot, **kwargs)
+
+
+class EditOutcomes:
+    EDITED = 'edited'
+    NOT_MODIFIED = 'not_modified'
+    MESSAGE_DELETED = 'message_deleted'
+    BOT_BLOCKED = 'bot_blocked'
+    SUPERSEDED = 'superseded'  # a newer version of the message is being propagated instead
+    FAILED = 'failed'
+
+    SUCCESSFUL = (EDITED, NOT_MODIFIED, SUPERSEDED)
+
+
+def is_not_modified_error(error):
+    return isinstance(error, BadRequest) and 'message is not modified' in str(error).lower()
+
+
+def get_edit_outcome(broadcast_result):
+    error = broadcast_result.error
+    if error is None:
+        if broadcast_result.value == EditOutcomes.NOT_MODIFIED:
+            return EditOutcomes.NOT_MODIFIED
+        return EditOutcomes.EDITED if broadcast_result.value else EditOutcomes.FAILED
+
+    if isinstance(error, BroadcastAborted):
+        return EditOutcomes.SUPERSEDED
+    if isinstance(error, Unauthorized):
+        return EditOutcomes.BOT_BLOCKED
+    if is_not_modified_error(error):
+        return EditOutcomes.NOT_MODIFIED
+    if isinstance(error, BadRequest) and 'message to edit not found' in str(error).lower():
+        return EditOutcomes.MESSAGE_DELETED
+    return EditOutcomes.FAILED
+
+
+def broadcast_edit(
+        broadcaster,
+        prepared_transmission,
+        receiver_bot,
+        msg_transmissions,
+        red_heart_default,
+        edit_version_watcher=None,
+):
+    """
+    Propagates an edit to all the receivers of the message concurrently (the propagation is aborted as soon as
+    edit_version_watcher reports that a newer version of the message came in). Returns a Counter of EditOutcomes.
+    """
+
+    def _edit(msg_transmission):
+        try:
+            return prepared_transmission.edit(
+                receiver_msg_id=int(msg_transmission[DdbFields.RECEIVER_MSG_ID]),
+                receiver_chat_id=int(msg_transmission[DdbFields.RECEIVER_CHAT_ID]),
+                receiver_bot=receiver_bot,  # msg_transmission[DdbFields.RECEIVER_BOT_ID] is of no use here
+                red_heart=msg_transmission.get(DdbFields.RED_HEART, red_heart_default),
+            )
+        except BadRequest as e:
+            if is_not_modified_error(e):
+                # the receiver has this version already - not a failure (hence not to be reported by the broadcaster)
+                return EditOutcomes.NOT_MODIFIED
+            raise
+
+    broadcast_results = broadcaster.broadcast(
+        msg_transmissions,
+        _edit,
+        get_chat_id=lambda msg_transmission: msg_transmission[DdbFields.RECEIVER_CHAT_ID],
+        should_abort=edit_version_watcher.is_stale if edit_version_watcher else None,
+    )
+
+    edit_outcomes = Counter(get_edit_outcome(result) for result in broadcast_results)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('EDIT OUTCOMES: %s', dict(edit_outcomes))
+    return edit_outcomes
 
-    return edited_msg
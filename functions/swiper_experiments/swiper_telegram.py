@@ -1,21 +1,85 @@
-import copy
+import asyncio
+import contextvars
+import hashlib
 import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from telegram import Bot, Update
+import simplejson  # handles decimal.Decimal
+from telegram import Bot, Update, User
 from telegram.ext import Dispatcher
 
-from functions.common.b64_json_utils import b64_encode_json, b64_decode_json_safe
-from functions.common.dynamodb import DdbFields
-from functions.common.s3 import main_bucket
-from functions.common.swiper_chat_data import read_swiper_chat_data, write_swiper_chat_data
-from functions.common.utils import generate_uuid
+from functions.common.audit import AuditArchive, AUDIT_MODE, AuditModes, audit_sink
+from functions.common.dynamodb import DdbFields, msg_transmission_table, batch_put_items, BATCH_WRITE_MAX_ITEMS
+from functions.common.s3 import main_bucket, put_s3_object
+from functions.common.swiper_chat_data import read_swiper_chat_data, update_swiper_chat_data, \
+    SwiperChatDataConflict, cache_swiper_chat_data
+from functions.common.utils import generate_uuid, fail_safely
+from functions.swiper_experiments.broadcaster import Broadcaster, AsyncBroadcaster
+from functions.swiper_experiments.constants import BROADCAST_MAX_WORKERS
 from functions.swiper_experiments.swiper_usernames import generate_swiper_username
+from functions.swiper_experiments.telegram_request import TelegramRequest
+from functions.swiper_experiments.update_processor import ChatOrderedUpdateProcessor, DEFAULT_UPDATE_WORKERS
 
 logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = os.environ['TELEGRAM_TOKEN']
+# optional: when known in advance, the bot never needs a getMe round-trip (PTB command handlers need the username)
+TELEGRAM_BOT_USERNAME = os.environ['TELEGRAM_BOT_USERNAME']
+
+# key attributes are not to be updated, version and active_swiper_bot_id are maintained by update_swiper_chat_data()
+SWIPER_DATA_NON_WRITABLE_FIELDS = frozenset((
+    DdbFields.CHAT_ID,
+    DdbFields.BOT_ID,
+    DdbFields.VERSION,
+    DdbFields.ACTIVE_SWIPER_BOT_ID,
+))
+
+# full batches of msg transmissions are written while the update is still in progress (see
+# SwiperUpdate.write_msg_transmission()), not by the broadcast workers that happen to fill them
+MSG_TRANSMISSION_WRITER_WORKERS = 2
+_msg_transmission_writer = ThreadPoolExecutor(
+    max_workers=MSG_TRANSMISSION_WRITER_WORKERS,
+    thread_name_prefix='transmissions',
+)
+
+# the update being processed in the current context (thread or asyncio task), see SwiperUpdate.__enter__()
+_current_swiper_update = contextvars.ContextVar('swiper_update', default=None)
+
+
+def fingerprint(value):
+    """
+    Cheap change detection for swiper data fields (instead of keeping a deep copy of the original data).
+    """
+    return hashlib.sha1(simplejson.dumps(value, sort_keys=True).encode('utf8')).digest()
+
+
+class SwiperBot(Bot):
+    """
+    The id of a bot is the part of its token before the colon, hence it is known without a getMe round-trip to
+    Telegram. The rest of the bot profile is fetched with getMe (once per container) if ever needed, unless the
+    username of the bot is provided upfront.
+    """
+
+    def __init__(self, token, *args, username=None, **kwargs):
+        super().__init__(token, *args, **kwargs)
+        self._bot_id = int(self.token.split(':')[0])
+
+        if username:
+            # first_name is not known without getMe (nothing in swiper relies on it)
+            self._bot = User(id=self._bot_id, first_name=username, is_bot=True, username=username, bot=self)
+
+    @property
+    def id(self):
+        return self._bot_id
+
+    def __eq__(self, other):
+        return isinstance(other, Bot) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
 
 
 class Swiper:
@@ -24,24 +88,19 @@ class Swiper:
         self.bot_id = bot_id
 
         self._swiper_data = None
-        self._swiper_data_original = None
-        self._swiper_username = None
+        self._persisted_fingerprints = None
 
     @property
     def swiper_data(self):
         if self._swiper_data is None:
-            self._swiper_data = read_swiper_chat_data(chat_id=self.chat_id, bot_id=self.bot_id)
-            self._swiper_data_original = copy.deepcopy(self._swiper_data)
-
-            self._swiper_data[DdbFields.CHAT] = b64_decode_json_safe(
-                self._swiper_data.get(DdbFields.CHAT)
-            )
-            self._swiper_data[DdbFields.SWIPER_USERNAME] = b64_decode_json_safe(
-                self._swiper_data.get(DdbFields.SWIPER_USERNAME)
-            )
+            self._hydrate(read_swiper_chat_data(chat_id=self.chat_id, bot_id=self.bot_id))
 
         return self._swiper_data
 
+    def _hydrate(self, swiper_data):
+        self._swiper_data = swiper_data
+        self._persisted_fingerprints = {field: fingerprint(value) for field, value in swiper_data.items()}
+
     def is_initialized(self):
         return self._swiper_data is not None
 
@@ -57,19 +116,49 @@ class Swiper:
             username = username_obj[DdbFields.USERNAME]
         return username
 
+    def get_changed_fields(self):
+        return {
+            field: value for field, value in self._swiper_data.items()
+            if field not in SWIPER_DATA_NON_WRITABLE_FIELDS and
+               fingerprint(value) != self._persisted_fingerprints.get(field)
+        }
+
     def persist(self):
         if not self.is_initialized():
             return
 
-        self._swiper_data[DdbFields.CHAT] = b64_encode_json(
-            self._swiper_data.get(DdbFields.CHAT)
-        )
-        self._swiper_data[DdbFields.SWIPER_USERNAME] = b64_encode_json(
-            self._swiper_data.get(DdbFields.SWIPER_USERNAME)
+        changed_fields = self.get_changed_fields()
+        if not changed_fields:
+            return
+
+        try:
+            self._write(changed_fields)
+        except SwiperChatDataConflict:
+            # somebody else has written the swiper in the meantime - our changes are applied on top of theirs (once)
+            logger.warning('SWIPER CHAT DATA CONFLICT (chat_id=%s ; bot_id=%s), retrying', self.chat_id, self.bot_id)
+            self._hydrate(read_swiper_chat_data(chat_id=self.chat_id, bot_id=self.bot_id, consistent_read=True))
+            self._swiper_data.update(changed_fields)
+            self._write(self.get_changed_fields())
+
+    def _write(self, changed_fields):
+        version = self._swiper_data.get(DdbFields.VERSION)
+        if version is None:
+            # the item doesn't exist yet or was written before versioning was introduced - it is written in full
+            changed_fields = {
+                field: value for field, value in self._swiper_data.items()
+                if field not in SWIPER_DATA_NON_WRITABLE_FIELDS
+            }
+
+        self._swiper_data[DdbFields.VERSION] = update_swiper_chat_data(
+            chat_id=self.chat_id,
+            bot_id=self.bot_id,
+            fields=changed_fields,
+            expected_version=version,
         )
+        for field, value in changed_fields.items():
+            self._persisted_fingerprints[field] = fingerprint(value)
 
-        if self._swiper_data != self._swiper_data_original:
-            write_swiper_chat_data(self._swiper_data)
+        cache_swiper_chat_data(self._swiper_data)
 
 
 class SwiperUpdate:
@@ -80,7 +169,8 @@ class SwiperUpdate:
         self.update_s3_key_prefix = f"audit/upd{self.ptb_update.update_id}_{generate_uuid()}"
         self.telegram_update_s3_key = f"{self.update_s3_key_prefix}.update.json"
 
-        main_bucket.put_object(
+        audit_sink.submit(
+            main_bucket.put_object,
             Key=self.telegram_update_s3_key,
             Body=json.dumps(update_json).encode('utf8'),
         )
@@ -88,6 +178,15 @@ class SwiperUpdate:
         self._swipers = {}
         self.current_swiper = self.get_swiper(self.ptb_update.effective_chat.id)
 
+        self._msg_transmissions_to_write = []
+        self._msg_transmission_writes = []  # futures of the full batches handed to the writer
+        self._archived_msg_transmission_ids = []  # written ones that point to the audit archive
+        self._msg_transmissions_lock = threading.Lock()  # transmissions may come from several broadcast workers
+
+        self.audit_archive = AuditArchive(f"{self.update_s3_key_prefix}.transmissions.jsonl.gz")
+
+        self._context_token = None
+
         self.volatile = {}  # to store reusable objects that are scoped to update and aren't to be persisted
 
     def get_swiper(self, chat_id):
@@ -100,6 +199,127 @@ class SwiperUpdate:
 
         return swiper
 
+    def audit_transmission(self, msg_transmission_id, transmitted_msg_dict):
+        """
+        Returns msg transmission fields that point to the audit record.
+        """
+        if AUDIT_MODE == AuditModes.UPDATE_ARCHIVE:
+            line, byte_range = self.audit_archive.append(transmitted_msg_dict)
+            return {
+                DdbFields.RECEIVER_MSG_S3_KEY: self.audit_archive.s3_key,
+                DdbFields.RECEIVER_MSG_S3_LINE: line,
+                DdbFields.RECEIVER_MSG_S3_BYTE_RANGE: byte_range,
+            }
+
+        receiver_msg_s3_key = f"{self.update_s3_key_prefix}.transmission.{msg_transmission_id}.json"
+        audit_sink.submit(
+            put_s3_object,
+            s3_bucket=main_bucket,
+            key=receiver_msg_s3_key,
+            obj_dict=transmitted_msg_dict,
+        )
+        return {
+            DdbFields.RECEIVER_MSG_S3_KEY: receiver_msg_s3_key,
+        }
+
+    def write_msg_transmission(self, msg_transmission, on_persisted=None):
+        """
+        Msg transmissions are buffered and written in batches. A full batch is handed to the writer right away (replies
+        to the receivers that got their messages early shouldn't wait for the whole broadcast to find the
+        transmission), the rest is written by flush_msg_transmissions() once the update is over. This is called by
+        broadcast workers, and a failed batch write is not to be blamed on the receiver that happened to fill the
+        batch - failures are raised by flush_msg_transmissions() instead.
+
+        on_persisted(msg_transmission) is called once the msg transmission is written (and never if it fails to be).
+        """
+        with self._msg_transmissions_lock:
+            self._msg_transmissions_to_write.append((msg_transmission, on_persisted))
+            if len(self._msg_transmissions_to_write) < BATCH_WRITE_MAX_ITEMS:
+                return
+            msg_transmissions = self._msg_transmissions_to_write
+            self._msg_transmissions_to_write = []
+
+            self._msg_transmission_writes.append(
+                _msg_transmission_writer.submit(self._write_msg_transmissions, msg_transmissions)
+            )
+
+    def flush_msg_transmissions(self):
+        """
+        Waits for the batches handed to the writer, writes the audit archive (before the rest of the msg transmissions,
+        which point to it) and then the rest of the buffer. The first failure (if any) is raised once all of that is
+        done.
+        """
+        with self._msg_transmissions_lock:
+            msg_transmission_writes = self._msg_transmission_writes
+            self._msg_transmission_writes = []
+
+        errors = []
+        for msg_transmission_write in msg_transmission_writes:
+            try:
+                msg_transmission_write.result()
+            except Exception as e:
+                errors.append(e)
+
+        self.flush_audit_archive()
+
+        with self._msg_transmissions_lock:
+            msg_transmissions = self._msg_transmissions_to_write
+            self._msg_transmissions_to_write = []
+
+        if msg_transmissions:
+            try:
+                self._write_msg_transmissions(msg_transmissions)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+    def _write_msg_transmissions(self, msg_transmissions_to_write):
+        msg_transmissions = [msg_transmission for msg_transmission, _ in msg_transmissions_to_write]
+        try:
+            batch_put_items(msg_transmission_table, msg_transmissions)
+        except Exception:
+            # some of the batches may have been written, but the ones that weren't can't be told apart
+            logger.error('FAILED TO WRITE %s MSG TRANSMISSIONS OF THE UPDATE', len(msg_transmissions))
+            raise
+
+        archived_msg_transmission_ids = [
+            msg_transmission[DdbFields.ID] for msg_transmission in msg_transmissions
+            if msg_transmission.get(DdbFields.RECEIVER_MSG_S3_KEY) == self.audit_archive.s3_key
+        ]
+        with self._msg_transmissions_lock:
+            self._archived_msg_transmission_ids.extend(archived_msg_transmission_ids)
+
+        for msg_transmission, on_persisted in msg_transmissions_to_write:
+            if on_persisted:
+                on_persisted(msg_transmission)
+
+    def flush_audit_archive(self):
+        """
+        The archive is written right away rather than via the audit sink (the sink may drop writes). Msg transmissions
+        that are still buffered are written only after it. If it fails to be written, the pointers to it are removed
+        from the buffered msg transmissions as well as from the ones that were written already (full batches are written
+        before the archive) instead of leaving them dangling.
+        """
+        try:
+            self.audit_archive.flush(main_bucket)
+        except Exception:
+            logger.exception('FAILED TO WRITE AUDIT ARCHIVE %s', self.audit_archive.s3_key)
+
+            with self._msg_transmissions_lock:
+                for msg_transmission, _ in self._msg_transmissions_to_write:
+                    if msg_transmission.get(DdbFields.RECEIVER_MSG_S3_KEY) == self.audit_archive.s3_key:
+                        msg_transmission.pop(DdbFields.RECEIVER_MSG_S3_KEY)
+                        msg_transmission.pop(DdbFields.RECEIVER_MSG_S3_LINE, None)
+                        msg_transmission.pop(DdbFields.RECEIVER_MSG_S3_BYTE_RANGE, None)
+
+                archived_msg_transmission_ids = self._archived_msg_transmission_ids
+                self._archived_msg_transmission_ids = []
+
+            for msg_transmission_id in archived_msg_transmission_ids:
+                fail_safely()(_remove_audit_pointer)(msg_transmission_id)
+
     def persist_swipers(self):
         if self.current_swiper.is_initialized() and self.ptb_update.effective_chat:
             self.current_swiper.swiper_data[DdbFields.CHAT] = self.ptb_update.effective_chat.to_dict()
@@ -108,26 +328,55 @@ class SwiperUpdate:
             swiper.persist()
 
     def __enter__(self):
-        # single-threaded environment with non-async update processing
-        self.swiper_conversation.swiper_update = self
-
+        self._context_token = _current_swiper_update.set(self)
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        self.swiper_conversation.swiper_update = None
-        self.persist_swipers()
+        _current_swiper_update.reset(self._context_token)
+        try:
+            self.flush_msg_transmissions()  # the audit archive is written by it as well
+        finally:
+            self.persist_swipers()
+
+
+def _remove_audit_pointer(msg_transmission_id):
+    msg_transmission_table.update_item(
+        Key={
+            DdbFields.ID: msg_transmission_id,
+        },
+        UpdateExpression=(
+            f"REMOVE {DdbFields.RECEIVER_MSG_S3_KEY}, {DdbFields.RECEIVER_MSG_S3_LINE}, "
+            f"{DdbFields.RECEIVER_MSG_S3_BYTE_RANGE}"
+        ),
+        # don't resurrect msg transmissions that were moved (see force_reply()) or deleted in the meantime
+        ConditionExpression=f"attribute_exists({DdbFields.ID})",
+    )
+
+
+def create_swiper_bot(concurrent_requests_num):
+    # broadcast workers share the bot, so its connection pool should be big enough for all of them
+    return SwiperBot(
+        TELEGRAM_TOKEN,
+        request=TelegramRequest(con_pool_size=concurrent_requests_num + 4),
+        username=TELEGRAM_BOT_USERNAME,
+    )
 
 
 class BaseSwiperConversation:
     """
-    BaseSwiperConversation is designed to work only in single-threaded environments that process telegram updates
-    sequentially (meaning, no asynchronous processing either).
+    The update that is being processed is carried in a context variable rather than in the conversation object, so
+    several updates can be processed concurrently by the same conversation (each in its own thread or in its own
+    copy of the context). Updates of the same chat are still expected to be processed one after another (see
+    ChatOrderedUpdateProcessor).
     """
 
-    def __init__(self, bot=None):
+    def __init__(self, bot=None, broadcaster=None):
         if not bot:
-            bot = Bot(TELEGRAM_TOKEN)
+            bot = create_swiper_bot(concurrent_requests_num=BROADCAST_MAX_WORKERS)
         # self.bot = bot
+        if not broadcaster:
+            broadcaster = Broadcaster()
+        self.broadcaster = broadcaster
 
         self.dispatcher = Dispatcher(
             bot,
@@ -136,7 +385,9 @@ class BaseSwiperConversation:
         )
         self.configure_dispatcher(self.dispatcher)
 
-        self.swiper_update = None
+    @property
+    def swiper_update(self):
+        return _current_swiper_update.get()
 
     def configure_dispatcher(self, dispatcher):
         """To be overridden by child classes."""
@@ -146,3 +397,34 @@ class BaseSwiperConversation:
         #     logger.info('TELEGRAM UPDATE:\n%s', pformat(update_json))
         with SwiperUpdate(self, update_json) as swiper_update:
             self.dispatcher.process_update(swiper_update.ptb_update)
+
+
+class AsyncSwiperConversation(BaseSwiperConversation):
+    """
+    asyncio processing mode. The event loop runs in a dedicated thread for the lifetime of the process. PTB handlers
+    are shared with the blocking mode (PTB 13 and boto3 are blocking, so handlers run in a pool of threads), but their
+    fan-outs (broadcasts and propagations of edits) run on the loop as gathered tasks (see AsyncBroadcaster).
+
+    process_update_json() keeps working (for ex., in the lambda handler). Async hosts use process_update_json_async()
+    or submit_update_json() - updates of the same chat are processed one after another in the order they were
+    submitted (see ChatOrderedUpdateProcessor).
+    """
+
+    def __init__(self, bot=None, update_workers=DEFAULT_UPDATE_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, name='asyncio', daemon=True)
+        self._loop_thread.start()
+
+        self._update_processor = ChatOrderedUpdateProcessor(self.process_update_json, max_workers=update_workers)
+
+        broadcaster = AsyncBroadcaster(self.loop)
+        if not bot:
+            bot = create_swiper_bot(concurrent_requests_num=broadcaster.max_tasks)
+        super().__init__(bot=bot, broadcaster=broadcaster)
+
+    async def process_update_json_async(self, update_json):
+        await asyncio.wrap_future(self.submit_update_json(update_json))
+
+    def submit_update_json(self, update_json):
+        """Returns a concurrent.futures.Future of the update being processed."""
+        return self._update_processor.submit(update_json)
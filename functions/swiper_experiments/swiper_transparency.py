@@ -6,20 +6,20 @@ from telegram.ext import CommandHandler, DispatcherHandlerStop, Filters, Message
 
 from functions.common import logging  # force log config of functions/common/__init__.py
 from functions.common.dynamodb import DdbFields
+from functions.common.edit_versions import EditVersionWatcher
 from functions.common.swiper_chat_data import find_all_active_swiper_chat_ids
-from functions.common.utils import send_partitioned_text
+from functions.common.utils import send_partitioned_text, start_in_background, peek_items
 from functions.swiper_experiments.constants import CallbackData, Texts, Commands, BLACK_HEARTS_ARE_SILENT
 from functions.swiper_experiments.message_transmitter import transmit_message, find_original_transmission, \
-    force_reply, find_transmissions_by_sender_msg, edit_transmission, prepare_msg_for_transmission, create_topic, \
-    create_allogrooming, find_allogrooming
-from functions.swiper_experiments.swiper_telegram import BaseSwiperConversation
+    force_reply, find_transmissions_by_sender_msg, broadcast_edit, EditOutcomes, prepare_msg_for_transmission, \
+    create_topic, upsert_allogrooming, broadcast_message, PreparedTransmission, compose_sender_msg_key
+from functions.swiper_experiments.swiper_telegram import BaseSwiperConversation, AsyncSwiperConversation
 
 logger = logging.getLogger(__name__)
 
 
 class SwiperTransparency(BaseSwiperConversation):
     def assert_swiper_authorized(self, update, context):
-        # single-threaded environment with non-async update processing
         if not self.swiper_update.current_swiper.is_swiper_authorized():
             # https://github.com/python-telegram-bot/python-telegram-bot/issues/849#issuecomment-332682845
             raise DispatcherHandlerStop()
@@ -41,7 +41,7 @@ class SwiperTransparency(BaseSwiperConversation):
         dispatcher.add_error_handler(self.handle_error)
 
     def help(self, update, context):
-        swiper_username = self.swiper_update.current_swiper.swiper_username  # non-async single-threaded environment
+        swiper_username = self.swiper_update.current_swiper.swiper_username
         update.effective_chat.send_message(
             text=Texts.get_help_msg(swiper_username),
             parse_mode=ParseMode.HTML,
@@ -59,28 +59,30 @@ class SwiperTransparency(BaseSwiperConversation):
         msg = prepare_msg_for_transmission(update.effective_message, context.bot)
 
         topic_id = create_topic(
-            swiper_update=self.swiper_update,  # non-async single-threaded environment
+            swiper_update=self.swiper_update,
             msg=msg,
             sender_bot_id=context.bot.id,
         )
 
-        transmitted = False
-        for swiper_chat_id in find_all_active_swiper_chat_ids(context.bot.id):
-            # TODO oleksandr: use thread-workers to broadcast in parallel ? (remember about Telegram limits too)
-            if str(swiper_chat_id) != str(update.effective_chat.id):
-                transmitted = transmit_message(
-                    swiper_update=self.swiper_update,  # non-async single-threaded environment
-                    msg=msg,
-                    sender_bot_id=context.bot.id,
-                    receiver_chat_id=swiper_chat_id,
-                    receiver_bot=context.bot,
-                    red_heart=False,
-                    topic_id=topic_id,
-                    disable_notification=BLACK_HEARTS_ARE_SILENT,
-                ) or transmitted
+        broadcast_results = broadcast_message(
+            swiper_update=self.swiper_update,
+            broadcaster=self.broadcaster,
+            msg=msg,
+            sender_bot_id=context.bot.id,
+            receiver_bot=context.bot,
+            receivers=(
+                {'receiver_chat_id': swiper_chat_id}
+                for swiper_chat_id in find_all_active_swiper_chat_ids(context.bot.id)
+                if str(swiper_chat_id) != str(update.effective_chat.id)
+            ),
+            red_heart=False,
+            topic_id=topic_id,
+            disable_notification=BLACK_HEARTS_ARE_SILENT,
+        )
+        transmitted = any(result.succeeded for result in broadcast_results)
 
         if transmitted:
-            swiper_username = self.swiper_update.current_swiper.swiper_username  # non-async single-threaded environment
+            swiper_username = self.swiper_update.current_swiper.swiper_username
             update.effective_chat.send_message(
                 text=Texts.get_new_topic_started_msg(swiper_username),
                 parse_mode=ParseMode.HTML,
@@ -92,13 +94,29 @@ class SwiperTransparency(BaseSwiperConversation):
 
     def edit_message(self, update, context):
         msg = update.effective_message
-        transmissions_by_sender_msg = find_transmissions_by_sender_msg(
+
+        # bursts of edits cost one propagation: stale versions are dropped (or aborted halfway through)
+        edit_version_watcher = EditVersionWatcher(
+            sender_msg_key=compose_sender_msg_key(
+                sender_msg_id=msg.message_id,
+                sender_chat_id=msg.chat.id,
+                sender_bot_id=msg.bot.id,
+            ),
+            edit_version=update.update_id,
+        )
+        if not edit_version_watcher.claim():
+            return
+        if not edit_version_watcher.debounce():
+            return
+
+        # only the first page of transmissions is waited for - the rest is read while the edit is being propagated
+        first_transmissions, transmissions_by_sender_msg = peek_items(find_transmissions_by_sender_msg(
             sender_msg_id=msg.message_id,
             sender_chat_id=msg.chat.id,
             sender_bot_id=msg.bot.id,
-        )
+        ), 2)
 
-        if not transmissions_by_sender_msg:
+        if not first_transmissions:
             update.effective_chat.send_message(
                 text=Texts.TALK_NOT_FOUND,
                 parse_mode=ParseMode.HTML,
@@ -107,49 +125,48 @@ class SwiperTransparency(BaseSwiperConversation):
             )
             return
 
-        red_heart_default = len(transmissions_by_sender_msg) < 2
+        red_heart_default = len(first_transmissions) < 2
+        prepared_transmission = PreparedTransmission(msg, self.swiper_update.current_swiper.swiper_username)
 
-        edited_at_receiver = True
-        for msg_transmission in transmissions_by_sender_msg:
-            # broadcast replies to own message
-
-            # TODO oleksandr: use thread-workers to broadcast in parallel ? (remember about Telegram limits too)
-            edited_at_receiver = edit_transmission(
-                swiper_update=self.swiper_update,  # non-async single-threaded environment
-                msg=msg,
-                receiver_msg_id=msg_transmission[DdbFields.RECEIVER_MSG_ID],
-                receiver_chat_id=msg_transmission[DdbFields.RECEIVER_CHAT_ID],
-                receiver_bot=context.bot,  # msg_transmission[DdbFields.RECEIVER_BOT_ID] is of no use here
-                red_heart=msg_transmission.get(DdbFields.RED_HEART, red_heart_default),
-            ) and edited_at_receiver
+        edit_outcomes = broadcast_edit(
+            broadcaster=self.broadcaster,
+            prepared_transmission=prepared_transmission,
+            receiver_bot=context.bot,
+            msg_transmissions=transmissions_by_sender_msg,
+            red_heart_default=red_heart_default,
+            edit_version_watcher=edit_version_watcher,
+        )
 
-        if not edited_at_receiver:
+        failed_num = sum(num for outcome, num in edit_outcomes.items() if outcome not in EditOutcomes.SUCCESSFUL)
+        if failed_num:
             update.effective_chat.send_message(
-                text=Texts.FAILED_TO_EDIT_AT_RECEIVER,
+                text=Texts.get_failed_to_edit_at_receiver_msg(failed_num, sum(edit_outcomes.values())),
                 parse_mode=ParseMode.HTML,
                 reply_to_message_id=msg.message_id,
                 # disable_notification=True,
             )
 
     def force_reply(self, update, context):
-        update.callback_query.answer()  # TODO oleksandr: make it failsafe
+        # the callback query is answered while the rest of the work is in progress
+        callback_query_answered = start_in_background(update.callback_query.answer)
+        try:
+            msg_transmission = find_original_transmission_by_msg(update.effective_message)
+            if not msg_transmission:
+                update.effective_chat.send_message(
+                    text=Texts.TALK_NOT_FOUND,
+                    parse_mode=ParseMode.HTML,
+                    reply_to_message_id=update.effective_message.message_id,
+                    # disable_notification=True,
+                )
+                update.effective_message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[]))
+                return
 
-        msg_transmission = find_original_transmission_by_msg(update.effective_message)
-        if not msg_transmission:
-            update.effective_chat.send_message(
-                text=Texts.TALK_NOT_FOUND,
-                parse_mode=ParseMode.HTML,
-                reply_to_message_id=update.effective_message.message_id,
-                # disable_notification=True,
+            force_reply(
+                original_msg=update.effective_message,
+                original_msg_transmission=msg_transmission,
             )
-            update.effective_message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=[]))
-            return
-
-        force_reply(
-            original_msg=update.effective_message,
-            original_msg_transmission=msg_transmission,
-        )
-        update.effective_message.delete()  # TODO oleksandr: make it failsafe ?
+        finally:
+            callback_query_answered.result()
 
     def transmit_reply(self, update, context):
         reply_to_msg = update.effective_message.reply_to_message
@@ -166,29 +183,20 @@ class SwiperTransparency(BaseSwiperConversation):
             allogrooming_id = None
             topic_id = msg_transmission.get(DdbFields.TOPIC_ID)
             if topic_id:
-                allogrooming = find_allogrooming(
-                    sender_chat_id=msg.chat_id,
+                allogrooming_id, is_new_allogrooming = upsert_allogrooming(
+                    swiper_update=self.swiper_update,
+                    msg=msg,
                     sender_bot_id=context.bot.id,
                     receiver_chat_id=msg_transmission[DdbFields.SENDER_CHAT_ID],
                     receiver_bot_id=msg_transmission[DdbFields.SENDER_BOT_ID],
                     topic_id=topic_id,
                 )
-                if allogrooming:
-                    allogrooming_id = allogrooming[DdbFields.ID]
-                else:
-                    allogrooming_id = create_allogrooming(
-                        swiper_update=self.swiper_update,  # non-async single-threaded environment
-                        msg=msg,
-                        sender_bot_id=context.bot.id,
-                        receiver_chat_id=msg_transmission[DdbFields.SENDER_CHAT_ID],
-                        receiver_bot_id=msg_transmission[DdbFields.SENDER_BOT_ID],
-                        topic_id=topic_id,
-                    )
+                if is_new_allogrooming:
                     disable_notification = False
                 # TODO oleksandr: notify if new allogrooming
 
             transmitted = transmit_message(
-                swiper_update=self.swiper_update,  # non-async single-threaded environment
+                swiper_update=self.swiper_update,
                 msg=msg,
                 sender_bot_id=context.bot.id,
                 receiver_chat_id=msg_transmission[DdbFields.SENDER_CHAT_ID],
@@ -203,13 +211,13 @@ class SwiperTransparency(BaseSwiperConversation):
                 report_msg_not_transmitted(update)
             return
 
-        transmissions_by_sender_msg = find_transmissions_by_sender_msg(
+        first_transmissions, transmissions_by_sender_msg = peek_items(find_transmissions_by_sender_msg(
             sender_msg_id=reply_to_msg.message_id,
             sender_chat_id=reply_to_msg.chat.id,
             sender_bot_id=reply_to_msg.bot.id,
-        )
+        ), 2)
 
-        if not transmissions_by_sender_msg:
+        if not first_transmissions:
             update.effective_chat.send_message(
                 text=Texts.TALK_NOT_FOUND,
                 parse_mode=ParseMode.HTML,
@@ -218,30 +226,34 @@ class SwiperTransparency(BaseSwiperConversation):
             )
             return
 
-        red_heart = len(transmissions_by_sender_msg) < 2
-
-        transmitted = False
-        for msg_transmission in transmissions_by_sender_msg:
-            # broadcast replies to own message
-
-            # TODO oleksandr: use thread-workers to broadcast in parallel (remember about Telegram limits too);
-            #  as a side effect it should also ensure that one failure doesn't stop the rest of broadcast
-            #  (an exception may happen if, for ex., a receiver has blocked the bot)
-            transmitted = transmit_message(
-                swiper_update=self.swiper_update,  # non-async single-threaded environment
-                msg=msg,
-                sender_bot_id=context.bot.id,
-                receiver_chat_id=msg_transmission[DdbFields.RECEIVER_CHAT_ID],
-                receiver_bot=context.bot,  # msg_transmission[DdbFields.RECEIVER_BOT_ID] is of no use here
-                red_heart=red_heart,
-                topic_id=msg_transmission.get(DdbFields.TOPIC_ID),
-                disable_notification=True,
-                allogrooming_id=msg_transmission.get(DdbFields.ALLOGROOMING_ID),
-                reply_to_msg_id=msg_transmission[DdbFields.RECEIVER_MSG_ID],
-            ) or transmitted  # TODO oleksandr: replace with "and" as in self.edit_message() handler ?
+        # replies to own message are broadcast to all the receivers of that message
+        broadcast_results = broadcast_message(
+            swiper_update=self.swiper_update,
+            broadcaster=self.broadcaster,
+            msg=msg,
+            sender_bot_id=context.bot.id,
+            receiver_bot=context.bot,  # msg_transmission[DdbFields.RECEIVER_BOT_ID] is of no use here
+            receivers=(
+                {
+                    'receiver_chat_id': msg_transmission[DdbFields.RECEIVER_CHAT_ID],
+                    'topic_id': msg_transmission.get(DdbFields.TOPIC_ID),
+                    'allogrooming_id': msg_transmission.get(DdbFields.ALLOGROOMING_ID),
+                    'reply_to_msg_id': msg_transmission[DdbFields.RECEIVER_MSG_ID],
+                }
+                for msg_transmission in transmissions_by_sender_msg
+            ),
+            red_heart=len(first_transmissions) < 2,
+            disable_notification=True,
+        )
 
-        if not transmitted:
-            report_msg_not_transmitted(update)
+        failed_num = sum(1 for result in broadcast_results if not result.succeeded)
+        if failed_num:
+            update.effective_chat.send_message(
+                text=Texts.get_not_transmitted_to_receivers_msg(failed_num, len(broadcast_results)),
+                parse_mode=ParseMode.HTML,
+                reply_to_message_id=update.effective_message.message_id,
+                # disable_notification=True,
+            )
 
     def handle_error(self, update, context):
         logger.error('ERROR IN A PTB HANDLER', exc_info=context.error)
@@ -250,6 +262,12 @@ class SwiperTransparency(BaseSwiperConversation):
         send_partitioned_text(update.effective_chat, error_str)
 
 
+class AsyncSwiperTransparency(AsyncSwiperConversation, SwiperTransparency):
+    """
+    The same handlers, but start_topic, transmit_reply and edit_message fan-outs run as asyncio tasks.
+    """
+
+
 def report_msg_not_transmitted(update):
     report_msg = update.effective_chat.send_message(
         text=Texts.MESSAGE_NOT_TRANSMITTED,
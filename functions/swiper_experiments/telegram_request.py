@@ -0,0 +1,112 @@
+import bisect
+import threading
+import time
+
+from telegram.utils.request import Request
+from telegram.vendor.ptb_urllib3.urllib3.connection import VerifiedHTTPSConnection
+from telegram.vendor.ptb_urllib3.urllib3.connectionpool import HTTPSConnectionPool
+
+from functions.swiper_experiments.constants import TELEGRAM_CONNECT_TIMEOUT_SEC, TELEGRAM_READ_TIMEOUT_SEC
+
+LATENCY_BUCKETS_MS = (25, 50, 100, 200, 400, 800, 1600, 3200)
+
+_connection_events = threading.local()
+
+
+class _TrackedHTTPSConnection(VerifiedHTTPSConnection):
+    def connect(self):
+        # a request runs in the thread that made it, so this tells whether the request had to open a new connection
+        # (TCP + TLS handshake) or reused a pooled one
+        _connection_events.connected = True
+        super().connect()
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)  # the last one is for everything slower than the slowest bucket
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, latency_ms):
+        self.counts[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def to_dict(self):
+        count = sum(self.counts)
+        labels = [f"<={bucket_ms}ms" for bucket_ms in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"]
+        return {
+            'count': count,
+            'avg_ms': round(self.total_ms / count, 1) if count else None,
+            'max_ms': round(self.max_ms, 1),
+            'histogram': {label: num for label, num in zip(labels, self.counts) if num},
+        }
+
+
+def _get_endpoint(url):
+    if '/file/bot' in url:
+        return 'file_download'
+    # the last part of the url is the name of Bot API method (the token is not to appear in the stats)
+    return url.rsplit('/', 1)[-1]
+
+
+class TelegramRequest(Request):
+    """
+    PTB Request tuned for broadcasts: the connection pool is meant to be sized to the broadcast concurrency (the bot
+    and hence its keep-alive connections live as long as the lambda container), connect/read timeouts are
+    configurable. Latencies of Bot API calls are collected per endpoint and separately for requests that had to open
+    a new connection (TCP + TLS handshake) and the ones that reused a pooled connection.
+    """
+
+    def __init__(
+            self,
+            con_pool_size,
+            connect_timeout=TELEGRAM_CONNECT_TIMEOUT_SEC,
+            read_timeout=TELEGRAM_READ_TIMEOUT_SEC,
+            **kwargs,
+    ):
+        super().__init__(
+            con_pool_size=con_pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            **kwargs,
+        )
+        if hasattr(self._con_pool, 'pool_classes_by_scheme'):
+            # instance level override (doesn't affect other PoolManagers)
+            self._con_pool.pool_classes_by_scheme = {
+                **self._con_pool.pool_classes_by_scheme,
+                'https': _TrackedHTTPSConnectionPool,
+            }
+
+        self._latency_histograms = {}
+        self._latency_lock = threading.Lock()
+
+    def _request_wrapper(self, method, url, *args, **kwargs):
+        _connection_events.connected = False
+        started_at = time.monotonic()
+        try:
+            return super()._request_wrapper(method, url, *args, **kwargs)
+        finally:
+            latency_ms = (time.monotonic() - started_at) * 1000
+            histogram_key = (_get_endpoint(url), 'new' if _connection_events.connected else 'reused')
+            with self._latency_lock:
+                histogram = self._latency_histograms.get(histogram_key)
+                if not histogram:
+                    histogram = LatencyHistogram()
+                    self._latency_histograms[histogram_key] = histogram
+                histogram.record(latency_ms)
+
+    def latency_stats(self):
+        """
+        Latency histograms since the container started: {"<endpoint> (<new|reused> connection)": {...}}
+        """
+        with self._latency_lock:
+            return {
+                f"{endpoint} ({connection} connection)": histogram.to_dict()
+                for (endpoint, connection), histogram in sorted(self._latency_histograms.items())
+            }
@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from functions.common import logging  # force log config of functions/common/__init__.py
+from functions.common.utils import submit_in_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPDATE_WORKERS = 8
+
+
+def get_update_chat_key(update_json):
+    """
+    Id of the chat the (raw) update belongs to, without deserializing the whole update. Updates without a chat (inline
+    queries etc.) are keyed by the user who caused them. None if neither is known.
+    """
+    for value in update_json.values():
+        if not isinstance(value, dict):
+            continue
+
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+
+        user = value.get('from')
+        if user:
+            return user.get('id')
+    return None
+
+
+class ChatOrderedUpdateProcessor:
+    """
+    Processes telegram updates concurrently with a pool of worker threads, except that updates of the same chat are
+    processed one after another in the order they were submitted (a reply should never overtake the message it
+    replies to, an edit should never overtake the original message etc.)
+    """
+
+    def __init__(self, process_func, max_workers=DEFAULT_UPDATE_WORKERS):
+        self.process_func = process_func
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='updates')
+        self._chat_queues = {}  # only chats that have updates in progress are tracked
+        self._lock = threading.Lock()
+
+    def submit(self, update_json, *args, **kwargs):
+        """
+        Returns a concurrent.futures.Future of what process_func returns. An exception raised by process_func is logged
+        and set on the future (it doesn't affect the updates that follow).
+        """
+        job = (Future(), update_json, args, kwargs)
+
+        chat_key = get_update_chat_key(update_json)
+        if chat_key is None:
+            # nothing to keep the order for
+            submit_in_context(self._executor, self._process, job)
+            return job[0]
+
+        with self._lock:
+            chat_queue = self._chat_queues.get(chat_key)
+            if chat_queue is not None:
+                # the worker that is busy with this chat will pick it up
+                chat_queue.append(job)
+                return job[0]
+            self._chat_queues[chat_key] = deque()
+
+        submit_in_context(self._executor, self._process_chat, chat_key, job)
+        return job[0]
+
+    def _process_chat(self, chat_key, job):
+        while True:
+            self._process(job)
+
+            with self._lock:
+                chat_queue = self._chat_queues[chat_key]
+                if not chat_queue:
+                    del self._chat_queues[chat_key]
+                    return
+                job = chat_queue.popleft()
+
+    def _process(self, job):
+        future, update_json, args, kwargs = job
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self.process_func(update_json, *args, **kwargs))
+        except Exception as e:
+            logger.exception('FAILED TO PROCESS UPDATE %s', update_json.get('update_id'))
+            future.set_exception(e)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
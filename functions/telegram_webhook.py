@@ -1,19 +1,35 @@
 import os
 
 from functions.common import logging  # force log config of functions/common/__init__.py
+from functions.common.audit import audit_sink
 from functions.common.utils import log_event_and_response, fail_safely
-from functions.swiper_experiments.swiper_transparency import SwiperTransparency
+from functions.swiper_experiments.constants import ASYNC_PROCESSING
+from functions.swiper_experiments.message_transmitter import msg_transmissions_cache
+from functions.swiper_experiments.swiper_transparency import SwiperTransparency, AsyncSwiperTransparency
+from functions.swiper_experiments.telegram_request import TelegramRequest
 
 logger = logging.getLogger()
 
-swiper_conversation = SwiperTransparency()
+if ASYNC_PROCESSING:
+    swiper_conversation = AsyncSwiperTransparency()
+else:
+    swiper_conversation = SwiperTransparency()
 
 
 @log_event_and_response
 @fail_safely()
 def webhook(event, context):
     update_json = event['body']
-    swiper_conversation.process_update_json(update_json)
+    try:
+        swiper_conversation.process_update_json(update_json)
+    finally:
+        audit_sink.drain()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('MSG TRANSMISSIONS CACHE STATS: %s', msg_transmissions_cache.stats())
+
+            telegram_request = swiper_conversation.dispatcher.bot.request
+            if isinstance(telegram_request, TelegramRequest):
+                logger.info('TELEGRAM BOT API LATENCIES: %s', telegram_request.latency_stats())
 
 
 @log_event_and_response
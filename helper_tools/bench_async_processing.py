@@ -0,0 +1,81 @@
+"""
+Blocking vs asyncio processing mode (ASYNC_PROCESSING) of telegramWebhook lambda: a new topic is broadcast to
+RECEIVERS_NUM active swipers and then edited. Telegram and AWS are replaced with local stand-ins (Bot API calls take
+BENCH_TELEGRAM_LATENCY_MS), Telegram rate limits are lifted unless BENCH_KEEP_RATE_LIMITS=yes. Besides the timings, the
+Bot API calls made by both modes are compared (they are expected to be the same).
+
+python helper_tools/bench_async_processing.py [RECEIVERS_NUM]
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from tests.stand_ins import LatentStandInRequest, compose_aws_stand_in, compose_update_json
+
+CHILD_FLAG = '--child'
+
+
+def run_child(receivers_num):
+    from helper_tools.helper_utils import set_env_vars
+
+    set_env_vars(project_dir='./')
+    os.environ['AUTHORIZE_STRANGERS_BY_DEFAULT'] = 'yes'
+    os.environ['TELEGRAM_TOKEN'] = '123456:fake'
+    os.environ['TELEGRAM_BOT_USERNAME'] = 'swiper_bot'
+    os.environ['EDIT_DEBOUNCE_SEC'] = '0'
+    if os.environ.get('BENCH_KEEP_RATE_LIMITS') != 'yes':
+        os.environ['TELEGRAM_GLOBAL_MSGS_PER_SEC'] = '1000000'
+        os.environ['TELEGRAM_CHAT_MSGS_PER_SEC'] = '1000000'
+
+    from functions import telegram_webhook
+    from functions.common.aws import get_session
+
+    get_session().events.register('before-send', compose_aws_stand_in(receivers_num))
+
+    request = LatentStandInRequest(float(os.environ.get('BENCH_TELEGRAM_LATENCY_MS', '50')) / 1000)
+    telegram_webhook.swiper_conversation.dispatcher.bot._request = request
+
+    topic_update = compose_update_json(1, 'New topic')
+    topic_update['message']['entities'] = []
+    edit_update = {'update_id': 2, 'edited_message': {**topic_update['message'], 'text': 'Edited topic'}}
+
+    timings_ms = {}
+    for title, update_json in (('topic_ms', topic_update), ('edit_ms', edit_update)):
+        started_at = time.perf_counter()
+        telegram_webhook.webhook({'body': update_json}, None)
+        timings_ms[title] = (time.perf_counter() - started_at) * 1000
+
+    print(json.dumps({
+        **timings_ms,
+        'threads': threading.active_count(),
+        'calls': sorted(request.calls, key=lambda call: (call[0], str(call[1]))),
+    }))
+
+
+def main(receivers_num):
+    results = {}
+    for async_processing in ('no', 'yes'):
+        output = subprocess.run(
+            [sys.executable, __file__, CHILD_FLAG, str(receivers_num)],
+            check=True,
+            stdout=subprocess.PIPE,
+            env={**os.environ, 'LOG_LEVEL': 'WARNING', 'ASYNC_PROCESSING': async_processing},
+        ).stdout
+        results[async_processing] = result = json.loads(output.decode('utf8').strip().splitlines()[-1])
+        print(f"ASYNC_PROCESSING={async_processing}: topic {result['topic_ms']:.1f} ms ; "
+              f"edit {result['edit_ms']:.1f} ms ; {len(result['calls'])} Bot API calls ; "
+              f"{result['threads']} threads ({receivers_num} receivers)")
+
+    print(f"SAME BOT API CALLS IN BOTH MODES: {results['no']['calls'] == results['yes']['calls']}")
+
+
+if __name__ == '__main__':
+    if CHILD_FLAG in sys.argv:
+        run_child(int(sys.argv[-1]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
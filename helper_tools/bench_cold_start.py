@@ -0,0 +1,95 @@
+"""
+Cold start benchmark of telegramWebhook lambda: every run is a fresh python process that imports
+functions/telegram_webhook.py and processes its first (and then second) update. Telegram and AWS are replaced with
+local stand-ins, so the numbers are about initialization work only (no network). Track them across releases.
+
+python helper_tools/bench_cold_start.py [RUNS_NUM]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from tests.stand_ins import aws_stand_in, compose_update_json
+
+CHILD_FLAG = '--child'
+
+
+class LocalStandInRequest:
+    def __init__(self):
+        self.calls = []
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        self.calls.append(method)
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Swiper', 'username': 'swiper_bot'}
+        return {
+            'message_id': len(self.calls),
+            'date': int(time.time()),
+            'chat': {'id': data['chat_id'], 'type': 'private'},
+            'text': data.get('text'),
+        }
+
+
+def run_child():
+    from helper_tools.helper_utils import set_env_vars
+
+    set_env_vars(project_dir='./')
+    os.environ['AUTHORIZE_STRANGERS_BY_DEFAULT'] = 'yes'
+    os.environ['TELEGRAM_TOKEN'] = '123456:fake'
+    os.environ['TELEGRAM_BOT_USERNAME'] = os.environ.get('BENCH_BOT_USERNAME', 'swiper_bot')  # '' to include getMe
+
+    started_at = time.perf_counter()
+    from functions import telegram_webhook
+    import_ms = (time.perf_counter() - started_at) * 1000
+
+    from functions.common.aws import get_session
+
+    # AWS clients are constructed lazily, hence it's not too late to plug the stand-in in
+    get_session().events.register('before-send', aws_stand_in)
+
+    request = LocalStandInRequest()
+    telegram_webhook.swiper_conversation.dispatcher.bot._request = request
+
+    update_ms = []
+    for update_id in (1, 2):
+        started_at = time.perf_counter()
+        telegram_webhook.webhook({'body': compose_update_json(update_id, '/about')}, None)
+        update_ms.append((time.perf_counter() - started_at) * 1000)
+
+    print(json.dumps({
+        'import_ms': import_ms,
+        'first_update_ms': update_ms[0],
+        'second_update_ms': update_ms[1],
+        'get_me_calls': request.calls.count('getMe'),
+    }))
+
+
+def main(runs_num):
+    results = []
+    for _ in range(runs_num):
+        output = subprocess.run(
+            [sys.executable, __file__, CHILD_FLAG],
+            check=True,
+            stdout=subprocess.PIPE,
+            env={**os.environ, 'LOG_LEVEL': 'WARNING'},
+        ).stdout
+        results.append(json.loads(output.decode('utf8').strip().splitlines()[-1]))
+
+    for metric in ('import_ms', 'first_update_ms', 'second_update_ms'):
+        values = [result[metric] for result in results]
+        print(f"{metric.upper()}: median {statistics.median(values):.1f} ; min {min(values):.1f} ; "
+              f"max {max(values):.1f} ({runs_num} runs)")
+    print(f"GET_ME CALLS PER COLD START: {max(result['get_me_calls'] for result in results)}")
+
+
+if __name__ == '__main__':
+    if CHILD_FLAG in sys.argv:
+        run_child()
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of per-receiver CPU cost of a broadcast: rendering the transmission for every receiver (how it used to
+be) vs rendering it once and reusing it for every receiver. Telegram is replaced with a local stand-in, so only
+rendering and request serialization are measured.
+
+python helper_tools/bench_prepared_transmission.py [RECEIVERS_NUM]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from helper_tools.helper_utils import set_env_vars
+
+set_env_vars(project_dir='./')
+
+from telegram import Bot, Message, MessageEntity, Chat
+
+from functions.swiper_experiments.message_transmitter import PreparedTransmission, transmission_kbd_markup
+
+
+class LocalStandInRequest:
+    def __init__(self):
+        self.message_id = 0
+
+    def post(self, url, data, timeout=None):
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': data['chat_id'], 'type': Chat.PRIVATE},
+            'text': data.get('text'),
+        }
+
+
+def main(receivers_num):
+    bot = Bot('123456:fake', request=LocalStandInRequest())
+    msg = Message(
+        message_id=1,
+        date=None,
+        chat=Chat(id=1, type=Chat.PRIVATE),
+        text='Привіт 👋 ' * 300,
+        entities=[MessageEntity(type=MessageEntity.BOLD, offset=i * 10, length=6) for i in range(100)],
+        bot=bot,
+    )
+    username = 'Hikaru4242'
+
+    def _render_per_receiver():
+        for receiver_chat_id in range(receivers_num):
+            PreparedTransmission(msg, username).send(
+                receiver_chat_id=receiver_chat_id,
+                receiver_bot=bot,
+                reply_markup=transmission_kbd_markup.__wrapped__(red_heart=False),
+            )
+
+    def _render_once():
+        prepared_transmission = PreparedTransmission(msg, username)
+        for receiver_chat_id in range(receivers_num):
+            prepared_transmission.send(
+                receiver_chat_id=receiver_chat_id,
+                receiver_bot=bot,
+                reply_markup=transmission_kbd_markup(red_heart=False),
+            )
+
+    for title, func in (('RENDER PER RECEIVER', _render_per_receiver), ('RENDER ONCE', _render_once)):
+        started_at = time.process_time()
+        func()
+        elapsed = time.process_time() - started_at
+        print(f"{title}: {elapsed * 1000 / receivers_num:.3f} ms of CPU per receiver ({receivers_num} receivers)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -9,6 +9,10 @@ def set_env_vars(project_dir='../', backend_stage='oleksandr', local_overlay=Fal
     if local_overlay:
         set_env_vars_from_yml(f"{project_dir}serverless.env-local.yml")
 
+    set_default_env_vars(backend_stage=backend_stage)
+
+
+def set_default_env_vars(backend_stage='oleksandr'):
     os.environ.setdefault('STAGE', backend_stage)
     os.environ.setdefault('REGION', 'us-east-1')
     os.environ.setdefault('ES_REGION', os.environ['REGION'])
@@ -19,7 +23,29 @@ def set_env_vars(project_dir='../', backend_stage='oleksandr', local_overlay=Fal
     os.environ.setdefault('MESSAGE_TRANSMISSION_DDB_TABLE_NAME', f"MessageTransmission-stb-{os.environ['STAGE']}")
     os.environ.setdefault('TOPIC_DDB_TABLE_NAME', f"Topic-stb-{os.environ['STAGE']}")
     os.environ.setdefault('ALLOGROOMING_DDB_TABLE_NAME', f"Allogrooming-stb-{os.environ['STAGE']}")
+    os.environ.setdefault('EDIT_VERSION_DDB_TABLE_NAME', f"EditVersion-stb-{os.environ['STAGE']}")
     os.environ.setdefault('MAIN_S3_BUCKET_NAME', f"stb-{os.environ['STAGE']}")
+    os.environ.setdefault('AUDIT_MODE', 'update_archive')
+    os.environ.setdefault('AUDIT_DURABILITY_POLICY', 'block')
+    os.environ.setdefault('AUDIT_QUEUE_SIZE', '256')
+    os.environ.setdefault('AUDIT_WORKERS', '4')
+    os.environ.setdefault('ACTIVE_SWIPERS_CACHE_TTL_SEC', '60')
+    os.environ.setdefault('SWIPERS_CACHE_TTL_SEC', '30')
+    os.environ.setdefault('SWIPERS_CACHE_MAX_SIZE', '1024')
+    os.environ.setdefault('LEGACY_DDB_KEY_READS', 'yes')
+    os.environ.setdefault('EDIT_DEBOUNCE_SEC', '1.5')
+    os.environ.setdefault('TRANSMISSIONS_CACHE_TTL_SEC', '300')
+    os.environ.setdefault('TRANSMISSIONS_CACHE_MAX_SIZE', '4096')
+    os.environ.setdefault('BROADCAST_MAX_WORKERS', '16')
+    os.environ.setdefault('ASYNC_PROCESSING', 'no')
+    os.environ.setdefault('ASYNC_BROADCAST_MAX_TASKS', '100')
+    os.environ.setdefault('TELEGRAM_BOT_USERNAME', '')
+    os.environ.setdefault('TELEGRAM_GLOBAL_MSGS_PER_SEC', '25')
+    os.environ.setdefault('TELEGRAM_CHAT_MSGS_PER_SEC', '1')
+    os.environ.setdefault('TELEGRAM_CONNECT_TIMEOUT_SEC', '5')
+    os.environ.setdefault('AWS_MAX_ATTEMPTS', '10')
+    os.environ.setdefault('DDB_LOW_LEVEL_BATCH_WRITES', 'yes')
+    os.environ.setdefault('TELEGRAM_READ_TIMEOUT_SEC', '5')
 
 
 def set_env_vars_from_yml(yml_filename):
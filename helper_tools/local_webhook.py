@@ -1,6 +1,5 @@
 import os
 import sys
-from threading import Thread
 
 from flask import Flask, request
 
@@ -12,6 +11,7 @@ set_env_vars(project_dir='./', local_overlay=True)
 
 from functions.telegram_webhook import webhook, swiper_conversation
 from functions.common import logging, LOG_LEVEL
+from functions.swiper_experiments.update_processor import ChatOrderedUpdateProcessor
 
 logging.basicConfig(level=LOG_LEVEL)
 
@@ -22,6 +22,9 @@ app = Flask(__name__)
 
 WEBHOOK_PATH = '/webhook'
 
+# updates of different chats are processed concurrently (like several lambda containers would do)
+update_processor = ChatOrderedUpdateProcessor(lambda update_json: webhook({'body': update_json}, None))
+
 
 @app.route('/')
 def set_local_webhook():
@@ -43,9 +46,7 @@ def set_local_webhook():
 
 @app.route(WEBHOOK_PATH, methods=['POST'])
 def local_webhook():
-    event = {'body': request.json}
-    thread = Thread(target=webhook, args=(event, None))
-    thread.start()
+    update_processor.submit(request.json)
 
     # response = Response(json.dumps('ok'), status=200)
     # response.headers['Content-Type'] = 'application/json'
@@ -0,0 +1,17 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_tools.helper_utils import set_default_env_vars
+
+# secrets and stage specific settings of serverless.env-<stage>.yml (Telegram and AWS are replaced with stand-ins)
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:fake')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('AUTHORIZE_STRANGERS_BY_DEFAULT', 'yes')
+os.environ.setdefault('BLACK_HEARTS_ARE_SILENT', 'yes')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'fake')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'fake')
+os.environ.setdefault('EDIT_DEBOUNCE_SEC', '0')
+
+set_default_env_vars()
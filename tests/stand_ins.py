@@ -0,0 +1,107 @@
+"""
+Local stand-ins for Telegram and AWS shared by the tests and the benchmarks in helper_tools/.
+"""
+import json
+import threading
+import time
+
+
+class LatentStandInRequest:
+    """Telegram Bot API stand-in: every call takes latency_sec and is recorded as (method, chat_id)."""
+
+    def __init__(self, latency_sec):
+        self.latency_sec = latency_sec
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        time.sleep(self.latency_sec)
+        with self._lock:
+            self.calls.append((method, data.get('chat_id')))
+            message_id = len(self.calls)
+        return {
+            'message_id': data.get('message_id', message_id),
+            'date': int(time.time()),
+            'chat': {'id': data['chat_id'], 'type': 'private'},
+            'text': data.get('text'),
+        }
+
+
+class _Raw:
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self, **_kwargs):
+        yield self._body
+
+
+def aws_stand_in(request, **kwargs):
+    """
+    To be registered as a 'before-send' handler of the boto3 session: S3 and DynamoDB requests are answered locally
+    (nothing is found, everything is written).
+    """
+    from botocore.awsrequest import AWSResponse
+
+    target = request.headers.get('X-Amz-Target')
+    if not target:
+        # S3 (PutObject of audit records)
+        return AWSResponse(request.url, 200, {}, _Raw(b''))
+    if isinstance(target, bytes):
+        target = target.decode('utf8')
+    operation = target.rsplit('.', 1)[-1]
+
+    if operation == 'UpdateItem':
+        body = {'Attributes': {'version': {'N': '1'}}}
+    elif operation == 'Query':
+        body = {'Items': [], 'Count': 0, 'ScannedCount': 0}
+    else:
+        body = {}  # GetItem (no item), PutItem, BatchWriteItem etc.
+    return AWSResponse(request.url, 200, {}, _Raw(json.dumps(body).encode('utf8')))
+
+
+def compose_aws_stand_in(receivers_num):
+    """
+    aws_stand_in() with receivers_num active swipers, each of them having received the message that is being edited.
+    """
+
+    def _aws_stand_in_with_receivers(request, **kwargs):
+        from botocore.awsrequest import AWSResponse
+
+        target = request.headers.get('X-Amz-Target') or b''
+        if isinstance(target, bytes):
+            target = target.decode('utf8')
+
+        if target.endswith('.Query') and (b'byActiveSwiperBotId' in request.body or b'bySenderMsgKey' in request.body):
+            if b'byActiveSwiperBotId' in request.body:
+                items = [{'chat_id': {'N': str(1000 + i)}} for i in range(receivers_num)]
+            else:
+                items = [
+                    {
+                        'id': {'S': f"{i}_{1000 + i}_123456"},
+                        'receiver_msg_id': {'N': str(i)},
+                        'receiver_chat_id': {'N': str(1000 + i)},
+                        'receiver_bot_id': {'N': '123456'},
+                    }
+                    for i in range(receivers_num)
+                ]
+            body = {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+            return AWSResponse(request.url, 200, {}, _Raw(json.dumps(body).encode('utf8')))
+
+        return aws_stand_in(request, **kwargs)
+
+    return _aws_stand_in_with_receivers
+
+
+def compose_update_json(update_id, text, chat_id=42):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Bench'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
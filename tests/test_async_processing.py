@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from telegram.ext import MessageHandler, Filters
+
+from functions.common.aws import get_session
+from functions.swiper_experiments import swiper_telegram
+from functions.swiper_experiments.broadcaster import AsyncBroadcaster, Broadcaster, TelegramRateLimiter
+from functions.swiper_experiments.constants import BROADCAST_MAX_WORKERS
+from functions.swiper_experiments.swiper_telegram import SwiperBot, AsyncSwiperConversation
+from functions.swiper_experiments.swiper_transparency import SwiperTransparency, AsyncSwiperTransparency
+from tests.stand_ins import LatentStandInRequest, compose_aws_stand_in, compose_update_json
+
+RECEIVERS_NUM = 20
+
+
+@pytest.fixture
+def aws_stand_in():
+    aws_stand_in = compose_aws_stand_in(RECEIVERS_NUM)
+    get_session().events.register('before-send', aws_stand_in)
+    yield
+    get_session().events.unregister('before-send', aws_stand_in)
+
+
+@pytest.fixture
+def event_loop_thread():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def _create_unlimited_rate_limiter():
+    return TelegramRateLimiter(global_msgs_per_sec=1000000, chat_msgs_per_sec=1000000)
+
+
+def _create_stand_in_bot():
+    return SwiperBot('123456:fake', request=LatentStandInRequest(latency_sec=0.005), username='swiper_bot')
+
+
+def _compose_message_update_json(update_id, chat_id, text):
+    update_json = compose_update_json(update_id, text, chat_id=chat_id)
+    update_json['message']['entities'] = []
+    return update_json
+
+
+def test_async_broadcast_is_not_bounded_by_broadcast_workers_and_keeps_the_context(event_loop_thread):
+    max_tasks = BROADCAST_MAX_WORKERS * 2
+    broadcaster = AsyncBroadcaster(
+        event_loop_thread,
+        max_tasks=max_tasks,
+        rate_limiter=_create_unlimited_rate_limiter(),
+    )
+    all_in_flight = threading.Barrier(max_tasks, timeout=5)
+
+    def _send(receiver):
+        all_in_flight.wait()  # breaks (and fails the send) unless max_tasks sends are in flight at the same time
+        return swiper_telegram._current_swiper_update.get()
+
+    context_token = swiper_telegram._current_swiper_update.set('update in progress')
+    try:
+        results = broadcaster.broadcast((receiver for receiver in range(max_tasks)), _send)
+    finally:
+        swiper_telegram._current_swiper_update.reset(context_token)
+
+    assert [result.error for result in results] == [None] * max_tasks
+    assert [result.value for result in results] == ['update in progress'] * max_tasks
+
+
+def test_updates_of_the_same_chat_are_processed_in_order_in_async_mode(aws_stand_in):
+    processed = []
+
+    class _RecordingConversation(AsyncSwiperConversation):
+        def configure_dispatcher(self, dispatcher):
+            dispatcher.add_handler(MessageHandler(Filters.all, self.record))
+
+        def record(self, update, context):
+            time.sleep(0.001 * (update.update_id % 3))  # later updates would overtake the earlier ones otherwise
+            assert self.swiper_update.ptb_update is update
+            processed.append((update.effective_chat.id, update.update_id))
+
+    swiper_conversation = _RecordingConversation(bot=_create_stand_in_bot())
+
+    async def _process_all():
+        await asyncio.gather(*(
+            swiper_conversation.process_update_json_async(
+                _compose_message_update_json(update_id, 40 + update_id % 2, 'Hello')
+            )
+            for update_id in range(20)
+        ))
+
+    asyncio.run(_process_all())
+
+    for chat_id in (40, 41):
+        update_ids = [update_id for processed_chat_id, update_id in processed if processed_chat_id == chat_id]
+        assert update_ids == sorted(update_ids)
+        assert len(update_ids) == 10
+
+
+def _make_bot_api_calls(swiper_conversation, process_update_json):
+    swiper_conversation.broadcaster.rate_limiter = _create_unlimited_rate_limiter()
+
+    topic_update_json = _compose_message_update_json(1, 42, 'New topic')
+    edit_update_json = {
+        'update_id': 2,
+        'edited_message': {**topic_update_json['message'], 'text': 'Edited topic'},
+    }
+    process_update_json(topic_update_json)
+    process_update_json(edit_update_json)
+
+    return sorted(swiper_conversation.dispatcher.bot.request.calls, key=lambda call: (call[0], str(call[1])))
+
+
+def test_async_and_blocking_modes_make_the_same_bot_api_calls(aws_stand_in):
+    blocking_conversation = SwiperTransparency(bot=_create_stand_in_bot(), broadcaster=Broadcaster())
+    blocking_calls = _make_bot_api_calls(blocking_conversation, blocking_conversation.process_update_json)
+
+    async_conversation = AsyncSwiperTransparency(bot=_create_stand_in_bot())
+    async_calls = _make_bot_api_calls(
+        async_conversation,
+        lambda update_json: async_conversation.submit_update_json(update_json).result(timeout=10),
+    )
+
+    # a new topic and its edit reach every active swiper
+    assert [method for method, _ in blocking_calls].count('sendMessage') >= RECEIVERS_NUM
+    assert [method for method, _ in blocking_calls].count('editMessageText') == RECEIVERS_NUM
+    assert async_calls == blocking_calls
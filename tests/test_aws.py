@@ -0,0 +1,39 @@
+import threading
+import time
+
+from functions.common import aws
+
+
+class _StandInSession:
+    def __init__(self):
+        self.in_progress = 0
+        self.max_in_progress = 0
+        self._lock = threading.Lock()
+
+    def _create(self, service_name, config=None):
+        with self._lock:
+            self.in_progress += 1
+            self.max_in_progress = max(self.max_in_progress, self.in_progress)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_progress -= 1
+        return service_name
+
+    client = _create
+    resource = _create
+
+
+def test_clients_and_resources_are_created_one_at_a_time(monkeypatch):
+    session = _StandInSession()
+    monkeypatch.setattr(aws, '_session', session)
+
+    threads = [
+        threading.Thread(target=create, args=('dynamodb',))
+        for create in (aws.create_client, aws.create_resource) * 4
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert session.max_in_progress == 1
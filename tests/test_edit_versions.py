@@ -0,0 +1,44 @@
+import pytest
+
+from functions.common import edit_versions
+from functions.common.edit_versions import EditVersionWatcher
+from functions.common.utils import timestamp_now_ms
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(edit_versions, 'EDIT_DEBOUNCE_SEC', 1.5)
+    monkeypatch.setattr(edit_versions.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def _claim(monkeypatch, previous_claimed_at_ms, newest_edit_version=2):
+    monkeypatch.setattr(edit_versions, 'claim_edit_version', lambda *args: (True, previous_claimed_at_ms))
+    monkeypatch.setattr(edit_versions, 'read_edit_version', lambda sender_msg_key: newest_edit_version)
+
+    edit_version_watcher = EditVersionWatcher(sender_msg_key='123456#20#10', edit_version=2)
+    assert edit_version_watcher.claim()
+    return edit_version_watcher
+
+
+@pytest.mark.parametrize('previous_claimed_at_ms', [None, 0])
+def test_lone_edit_is_not_debounced(monkeypatch, sleeps, previous_claimed_at_ms):
+    edit_version_watcher = _claim(monkeypatch, previous_claimed_at_ms)
+
+    assert edit_version_watcher.debounce()
+    assert sleeps == []
+
+
+def test_edit_in_burst_is_debounced(monkeypatch, sleeps):
+    edit_version_watcher = _claim(monkeypatch, timestamp_now_ms() - 500)
+
+    assert edit_version_watcher.debounce()
+    assert sleeps == [1.5]
+
+
+def test_edit_in_burst_is_dropped_if_superseded_while_debounced(monkeypatch, sleeps):
+    edit_version_watcher = _claim(monkeypatch, timestamp_now_ms() - 500, newest_edit_version=3)
+
+    assert not edit_version_watcher.debounce()
+    assert sleeps == [1.5]
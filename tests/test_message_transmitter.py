@@ -0,0 +1,227 @@
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+from telegram.error import BadRequest
+
+from functions.common.dynamodb import DdbFields
+from functions.swiper_experiments import message_transmitter
+from functions.swiper_experiments.broadcaster import Broadcaster, TelegramRateLimiter
+from functions.swiper_experiments.message_transmitter import EditOutcomes
+
+
+def _transmission(msg_transmission_id, receiver_chat_id):
+    return {
+        DdbFields.ID: msg_transmission_id,
+        DdbFields.RECEIVER_MSG_ID: 1,
+        DdbFields.RECEIVER_CHAT_ID: receiver_chat_id,
+        DdbFields.RECEIVER_BOT_ID: 123456,
+    }
+
+
+def test_find_transmissions_by_sender_msg_mixes_new_key_and_legacy_rows(monkeypatch):
+    items_by_index = {
+        # the copy made by force_reply() has sender_msg_key already, the original legacy row is still in the index
+        'bySenderMsgKey': [_transmission('a', 1), _transmission('b_copy', 2)],
+        'bySenderMsgId': [_transmission('b', 2), _transmission('a', 1), _transmission('c', 3)],
+    }
+    monkeypatch.setattr(message_transmitter, 'LEGACY_DDB_KEY_READS', True)
+    monkeypatch.setattr(
+        message_transmitter,
+        'query_items',
+        lambda table, IndexName, **kwargs: iter(items_by_index[IndexName]),
+    )
+
+    transmissions = list(message_transmitter.find_transmissions_by_sender_msg(
+        sender_msg_id=10,
+        sender_chat_id=20,
+        sender_bot_id=123456,
+    ))
+
+    assert [item[DdbFields.ID] for item in transmissions] == ['a', 'b_copy', 'b', 'c']
+
+
+def test_find_transmissions_by_sender_msg_without_legacy_reads(monkeypatch):
+    queried_indexes = []
+
+    def _query_items(table, IndexName, **kwargs):
+        queried_indexes.append(IndexName)
+        return iter([_transmission('a', 1)])
+
+    monkeypatch.setattr(message_transmitter, 'LEGACY_DDB_KEY_READS', False)
+    monkeypatch.setattr(message_transmitter, 'query_items', _query_items)
+
+    transmissions = list(message_transmitter.find_transmissions_by_sender_msg(
+        sender_msg_id=10,
+        sender_chat_id=20,
+        sender_bot_id=123456,
+    ))
+
+    assert [item[DdbFields.ID] for item in transmissions] == ['a']
+    assert queried_indexes == ['bySenderMsgKey']
+
+
+class _StandInMsg:
+    def __init__(self, message_id, events):
+        self.message_id = message_id
+        self.chat = SimpleNamespace(id=20)
+        self.bot = SimpleNamespace(id=123456)
+        self.reply_to_message = None
+        self.events = events
+
+    def delete(self):
+        self.events.append(('delete', self.message_id))
+        return True
+
+
+def _force_reply(monkeypatch, events, transaction_error=None):
+    def _transact_write_items(TransactItems):
+        events.append(('transaction', len(TransactItems)))
+        if transaction_error:
+            raise transaction_error
+
+    monkeypatch.setattr(message_transmitter, 'msg_transmission_table', SimpleNamespace(
+        name='MessageTransmission',
+        meta=SimpleNamespace(client=SimpleNamespace(transact_write_items=_transact_write_items)),
+    ))
+    monkeypatch.setattr(message_transmitter, '_ptb_transmit', lambda msg, **kwargs: _StandInMsg(2, events))
+
+    original_msg_transmission = {
+        **_transmission('123456_20_1', 20),
+        DdbFields.SENDER_MSG_ID: 10,
+        DdbFields.SENDER_CHAT_ID: 30,
+        DdbFields.SENDER_BOT_ID: 123456,
+    }
+    message_transmitter.force_reply(_StandInMsg(1, events), original_msg_transmission)
+
+
+def test_force_reply_deletes_original_msg_after_transaction(monkeypatch):
+    events = []
+    _force_reply(monkeypatch, events)
+    assert events == [('transaction', 2), ('delete', 1)]
+
+
+def test_force_reply_keeps_original_msg_if_transaction_fails(monkeypatch):
+    events = []
+    with pytest.raises(RuntimeError):
+        _force_reply(monkeypatch, events, transaction_error=RuntimeError('throttled'))
+    # the ForceReply copy is deleted instead
+    assert events == [('transaction', 2), ('delete', 2)]
+
+
+class _StandInAllogroomingTable:
+    """Applies `SET field = if_not_exists(field, :field), ...` updates to in-memory items."""
+
+    def __init__(self, items=()):
+        self.items = {item[DdbFields.ID]: dict(item) for item in items}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ReturnValues, ConditionExpression=None):
+        if ConditionExpression == f"attribute_exists({DdbFields.ID})" and Key[DdbFields.ID] not in self.items:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        item = self.items.setdefault(Key[DdbFields.ID], dict(Key))
+        for placeholder, value in ExpressionAttributeValues.items():
+            item.setdefault(placeholder[1:], value)
+        return {'Attributes': dict(item)}
+
+
+def _derived_allogrooming_id():
+    return message_transmitter.compose_topic_sender_receiver_key(
+        topic_id='topic',
+        sender_chat_id=20,
+        sender_bot_id=123456,
+        receiver_chat_id=30,
+        receiver_bot_id=123456,
+    )
+
+
+def _upsert_allogrooming(update_s3_key):
+    return message_transmitter.upsert_allogrooming(
+        swiper_update=SimpleNamespace(telegram_update_s3_key=update_s3_key),
+        msg=SimpleNamespace(message_id=10, chat_id=20),
+        sender_bot_id=123456,
+        receiver_chat_id=30,
+        receiver_bot_id=123456,
+        topic_id='topic',
+    )
+
+
+@pytest.mark.parametrize('legacy_allogrooming_ids, expected_id', [
+    ([], None),
+    (['legacy-b', 'legacy-a'], 'legacy-a'),
+])
+def test_concurrent_first_replies_resolve_to_the_same_allogrooming(
+        monkeypatch,
+        legacy_allogrooming_ids,
+        expected_id,
+):
+    monkeypatch.setattr(message_transmitter, 'LEGACY_DDB_KEY_READS', True)
+    monkeypatch.setattr(message_transmitter, 'allogrooming_table', _StandInAllogroomingTable())
+    monkeypatch.setattr(
+        message_transmitter,
+        '_find_legacy_allogroomings',
+        lambda **kwargs: iter([{DdbFields.ID: legacy_id} for legacy_id in legacy_allogrooming_ids]),
+    )
+
+    expected_id = expected_id or _derived_allogrooming_id()
+
+    first_reply = _upsert_allogrooming('audit/upd1')
+    second_reply = _upsert_allogrooming('audit/upd2')
+
+    assert first_reply == (expected_id, not legacy_allogrooming_ids)
+    assert second_reply == (expected_id, False)
+
+
+@pytest.mark.parametrize('legacy_allogrooming_id', [None, 'legacy-a'])
+def test_existing_allogrooming_is_upserted_without_legacy_lookup(monkeypatch, legacy_allogrooming_id):
+    stored_allogrooming = {DdbFields.ID: _derived_allogrooming_id(), DdbFields.SENDER_UPDATE_S3_KEY: 'audit/upd1'}
+    if legacy_allogrooming_id:
+        # re-keyed by the backfill
+        stored_allogrooming[DdbFields.LEGACY_ID] = legacy_allogrooming_id
+
+    monkeypatch.setattr(message_transmitter, 'LEGACY_DDB_KEY_READS', True)
+    monkeypatch.setattr(message_transmitter, 'allogrooming_table', _StandInAllogroomingTable([stored_allogrooming]))
+    monkeypatch.setattr(message_transmitter, '_find_legacy_allogroomings', lambda **kwargs: pytest.fail())
+
+    assert _upsert_allogrooming('audit/upd2') == (legacy_allogrooming_id or _derived_allogrooming_id(), False)
+
+
+class _StandInPreparedTransmission:
+    def edit(self, receiver_msg_id, receiver_chat_id, receiver_bot, red_heart):
+        if receiver_chat_id == 2:
+            raise BadRequest('Message is not modified: specified new message content and reply markup are exactly '
+                             'the same as a current content and reply markup of the message')
+        if receiver_chat_id == 3:
+            raise BadRequest('Message to edit not found')
+        return True
+
+
+def test_broadcast_edit_does_not_report_unmodified_messages_as_failures(caplog):
+    edit_outcomes = message_transmitter.broadcast_edit(
+        broadcaster=Broadcaster(rate_limiter=TelegramRateLimiter(1000000, 1000000)),
+        prepared_transmission=_StandInPreparedTransmission(),
+        receiver_bot=None,
+        msg_transmissions=[_transmission(str(chat_id), chat_id) for chat_id in (1, 2, 3)],
+        red_heart_default=False,
+    )
+
+    assert edit_outcomes == {
+        EditOutcomes.EDITED: 1,
+        EditOutcomes.NOT_MODIFIED: 1,
+        EditOutcomes.MESSAGE_DELETED: 1,
+    }
+    # only the receiver that deleted the message is reported by the broadcaster
+    assert 'chat_id=2' not in caplog.text
+    assert 'chat_id=3' in caplog.text
+
+
+def test_cached_msg_transmission_is_a_copy():
+    msg_transmission = _transmission('1_77_123456', 77)
+    message_transmitter.cache_msg_transmission(msg_transmission)
+    msg_transmission[DdbFields.RECEIVER_MSG_S3_KEY] = 'audit/upd1.transmissions.jsonl.gz'
+
+    cached_msg_transmission = message_transmitter.find_original_transmission(
+        receiver_msg_id=1,
+        receiver_chat_id=77,
+        receiver_bot_id=123456,
+    )
+    assert cached_msg_transmission == _transmission('1_77_123456', 77)
@@ -0,0 +1,32 @@
+import base64
+import json
+from decimal import Decimal
+
+from functions.common.dynamodb import DdbFields
+from functions.common.swiper_chat_data import decode_swiper_chat_data
+
+
+def _b64_json(obj):
+    return base64.b64encode(json.dumps(obj).encode('utf-8')).decode('ascii')
+
+
+def test_native_and_legacy_fields_are_decoded():
+    item = decode_swiper_chat_data({
+        DdbFields.CHAT_ID: Decimal(1001),
+        DdbFields.CHAT: {'id': Decimal(1001), 'type': 'private'},
+        DdbFields.SWIPER_USERNAME: _b64_json({DdbFields.USERNAME: 'swiper1001'}),
+    })
+
+    assert item[DdbFields.CHAT] == {'id': 1001, 'type': 'private'}
+    assert item[DdbFields.SWIPER_USERNAME] == {DdbFields.USERNAME: 'swiper1001'}
+
+
+def test_corrupt_legacy_field_is_dropped():
+    item = decode_swiper_chat_data({
+        DdbFields.CHAT_ID: Decimal(1001),
+        DdbFields.CHAT: _b64_json({'id': 1001, 'type': 'private'}),
+        DdbFields.SWIPER_USERNAME: 'not base64 json',
+    })
+
+    assert item[DdbFields.CHAT] == {'id': 1001, 'type': 'private'}
+    assert DdbFields.SWIPER_USERNAME not in item
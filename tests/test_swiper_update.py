@@ -0,0 +1,157 @@
+import threading
+
+import pytest
+
+from functions.common.audit import AuditArchive
+from functions.common.dynamodb import DdbFields
+from functions.swiper_experiments import swiper_telegram
+from functions.swiper_experiments.swiper_telegram import SwiperUpdate
+
+
+def _create_swiper_update():
+    # only the msg transmission buffer of the update is needed
+    swiper_update = SwiperUpdate.__new__(SwiperUpdate)
+    swiper_update._msg_transmissions_to_write = []
+    swiper_update._msg_transmission_writes = []
+    swiper_update._archived_msg_transmission_ids = []
+    swiper_update._msg_transmissions_lock = threading.Lock()
+    swiper_update.audit_archive = AuditArchive('audit/upd1.transmissions.jsonl.gz')
+    return swiper_update
+
+
+class _StandInBucket:
+    name = 'stand-in'
+
+    def __init__(self, events, fail=False):
+        self.events = events
+        self.fail = fail
+
+    def put_object(self, Key, **kwargs):
+        if self.fail:
+            raise RuntimeError('S3 is unavailable')
+        self.events.append(('put_object', Key))
+
+
+def _write_audited_transmission(swiper_update, msg_transmission_id='1'):
+    line, byte_range = swiper_update.audit_archive.append({'message_id': 1})
+    swiper_update.write_msg_transmission({
+        DdbFields.ID: msg_transmission_id,
+        DdbFields.RECEIVER_MSG_S3_KEY: swiper_update.audit_archive.s3_key,
+        DdbFields.RECEIVER_MSG_S3_LINE: line,
+        DdbFields.RECEIVER_MSG_S3_BYTE_RANGE: byte_range,
+    })
+
+
+def test_full_batches_are_written_by_the_writer_and_the_rest_when_flushed(monkeypatch):
+    written_batches = []
+
+    def _batch_put_items(table, items):
+        written_batches.append(([item['id'] for item in items], threading.current_thread().name))
+
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket([]))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', _batch_put_items)
+
+    swiper_update = _create_swiper_update()
+    for i in range(60):
+        swiper_update.write_msg_transmission({'id': str(i)})
+    for msg_transmission_write in swiper_update._msg_transmission_writes:
+        msg_transmission_write.result()
+
+    assert [batch for batch, _ in written_batches] == [[str(i) for i in range(25)], [str(i) for i in range(25, 50)]]
+    # not by the broadcast worker that filled the batch
+    assert all(thread_name.startswith('transmissions') for _, thread_name in written_batches)
+
+    swiper_update.flush_msg_transmissions()
+    assert written_batches[-1] == ([str(i) for i in range(50, 60)], threading.current_thread().name)
+
+    swiper_update.flush_msg_transmissions()
+    assert len(written_batches) == 3
+
+
+def test_failed_msg_transmissions_write_is_raised_from_flush(monkeypatch):
+    written_batches = []
+
+    def _batch_put_items(table, items):
+        if items[0]['id'] == '0':
+            raise RuntimeError('throttled')
+        written_batches.append(items)
+
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket([]))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', _batch_put_items)
+
+    swiper_update = _create_swiper_update()
+    for i in range(30):
+        swiper_update.write_msg_transmission({'id': str(i)})  # the broadcast worker is not affected
+
+    with pytest.raises(RuntimeError):
+        swiper_update.flush_msg_transmissions()
+    # the rest of the buffer is written nevertheless
+    assert [[item['id'] for item in batch] for batch in written_batches] == [[str(i) for i in range(25, 30)]]
+
+
+def test_audit_archive_is_written_before_msg_transmissions(monkeypatch):
+    events = []
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket(events))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', lambda table, items: events.append(('batch_put', items)))
+
+    swiper_update = _create_swiper_update()
+    _write_audited_transmission(swiper_update)
+    swiper_update.flush_msg_transmissions()
+
+    assert [event[0] for event in events] == ['put_object', 'batch_put']
+    assert events[1][1][0][DdbFields.RECEIVER_MSG_S3_KEY] == swiper_update.audit_archive.s3_key
+
+
+def test_msg_transmissions_do_not_point_to_audit_archive_that_failed(monkeypatch):
+    events = []
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket(events, fail=True))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', lambda table, items: events.append(('batch_put', items)))
+
+    swiper_update = _create_swiper_update()
+    _write_audited_transmission(swiper_update)
+    swiper_update.flush_msg_transmissions()
+
+    assert events == [('batch_put', [{DdbFields.ID: '1'}])]
+
+
+def test_written_msg_transmissions_do_not_point_to_audit_archive_that_failed(monkeypatch):
+    removed_pointers = []
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket([], fail=True))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', lambda table, items: None)
+    monkeypatch.setattr(swiper_telegram, '_remove_audit_pointer', removed_pointers.append)
+
+    swiper_update = _create_swiper_update()
+    for i in range(26):
+        # the first 25 are written before the archive
+        _write_audited_transmission(swiper_update, msg_transmission_id=str(i))
+    swiper_update.flush_msg_transmissions()
+
+    assert removed_pointers == [str(i) for i in range(25)]
+
+
+@pytest.mark.parametrize('write_fails', [False, True])
+def test_on_persisted_is_called_only_after_msg_transmission_is_written(monkeypatch, write_fails):
+    events = []
+
+    def _batch_put_items(table, items):
+        if write_fails:
+            raise RuntimeError('throttled')
+        events.append(('batch_put', [item['id'] for item in items]))
+
+    monkeypatch.setattr(swiper_telegram, 'main_bucket', _StandInBucket([]))
+    monkeypatch.setattr(swiper_telegram, 'batch_put_items', _batch_put_items)
+
+    swiper_update = _create_swiper_update()
+    swiper_update.write_msg_transmission(
+        {'id': '1'},
+        on_persisted=lambda msg_transmission: events.append(('persisted', msg_transmission['id'])),
+    )
+    assert events == []
+
+    if write_fails:
+        with pytest.raises(RuntimeError):
+            swiper_update.flush_msg_transmissions()
+        assert events == []
+    else:
+        swiper_update.flush_msg_transmissions()
+        assert events == [('batch_put', ['1']), ('persisted', '1')]
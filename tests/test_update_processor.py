@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from functions.swiper_experiments.update_processor import ChatOrderedUpdateProcessor, get_update_chat_key
+
+
+def _compose_update_json(update_id, chat_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'Hello',
+        },
+    }
+
+
+@pytest.mark.parametrize('update_json, chat_key', [
+    (_compose_update_json(1, 42), 42),
+    ({'update_id': 1, 'edited_message': {'message_id': 1, 'chat': {'id': 43}, 'from': {'id': 1}}}, 43),
+    ({'update_id': 1, 'channel_post': {'message_id': 1, 'chat': {'id': -100}}}, -100),
+    (
+        {
+            'update_id': 1,
+            'callback_query': {'id': 'q', 'from': {'id': 1}, 'message': {'message_id': 1, 'chat': {'id': 44}}},
+        },
+        44,
+    ),
+    ({'update_id': 1, 'callback_query': {'id': 'q', 'from': {'id': 45}, 'inline_message_id': 'm'}}, 45),
+    ({'update_id': 1, 'inline_query': {'id': 'q', 'from': {'id': 46}, 'query': ''}}, 46),
+    ({'update_id': 1}, None),
+])
+def test_get_update_chat_key(update_json, chat_key):
+    assert get_update_chat_key(update_json) == chat_key
+
+
+def test_updates_of_the_same_chat_are_processed_in_order():
+    processed = []
+
+    def _process(update_json):
+        time.sleep(0.001 * (update_json['update_id'] % 3))  # later updates would overtake the earlier ones otherwise
+        processed.append((update_json['message']['chat']['id'], update_json['update_id']))
+
+    processor = ChatOrderedUpdateProcessor(_process, max_workers=4)
+    futures = [processor.submit(_compose_update_json(update_id, 40 + update_id % 2)) for update_id in range(30)]
+    for future in futures:
+        future.result(timeout=5)
+
+    for chat_id in (40, 41):
+        update_ids = [update_id for processed_chat_id, update_id in processed if processed_chat_id == chat_id]
+        assert update_ids == sorted(update_ids)
+        assert len(update_ids) == 15
+
+
+def test_updates_of_different_chats_are_processed_concurrently():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def _process(update_json):
+        both_started.wait()  # breaks (and raises) if the two chats were processed one after another
+
+    processor = ChatOrderedUpdateProcessor(_process, max_workers=2)
+    futures = [processor.submit(_compose_update_json(1, 40)), processor.submit(_compose_update_json(2, 41))]
+
+    for future in futures:
+        future.result(timeout=5)
+
+
+def test_failed_update_does_not_affect_the_rest_of_the_chat():
+    processed = []
+
+    def _process(update_json):
+        if update_json['update_id'] == 1:
+            raise RuntimeError('handler failed')
+        processed.append(update_json['update_id'])
+        return update_json['update_id']
+
+    processor = ChatOrderedUpdateProcessor(_process, max_workers=2)
+    futures = [processor.submit(_compose_update_json(update_id, 40)) for update_id in range(3)]
+
+    assert futures[0].result(timeout=5) == 0
+    with pytest.raises(RuntimeError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 2
+    assert processed == [0, 2]